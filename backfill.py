@@ -0,0 +1,16 @@
+import os
+
+# Same as `main.py`, sockets must be patched before `indexer.data` connects.
+if os.getenv('COOPERATIVE_IO', 'true').lower() not in ('0', 'false', 'no'):
+    from gevent import monkey
+    monkey.patch_all()
+
+from indexer.rpc import bridge_callback
+from indexer.db import ensure_indexes
+from indexer.data import INDEXER_CHAINS
+from indexer.segments import backfill
+
+if __name__ == '__main__':
+    ensure_indexes()
+    # Claims segments leased from redis, run it on as many nodes as wanted.
+    backfill(bridge_callback, INDEXER_CHAINS)
@@ -0,0 +1,256 @@
+from typing import Any, DefaultDict, Dict, Iterable, List, NamedTuple, \
+    Optional, Tuple
+from collections import OrderedDict, defaultdict
+import json
+
+from web3._utils.method_formatters import transaction_result_formatter, \
+    receipt_formatter
+from web3._utils.request import make_post_request
+from web3.types import BlockData, LogReceipt, TxData, TxReceipt
+from hexbytes import HexBytes
+from web3 import Web3
+
+from indexer.data import SYN_DATA, RPC_BATCH_SIZE, BLOCK_CACHE_SIZE
+from indexer.endpoints import PoolProvider
+from indexer.decoders import INPUT_TOPICS
+
+Call = Tuple[str, List[Any]]
+
+
+class Enrichment(NamedTuple):
+    """
+    Everything `bridge_callback` needs from the node besides the log and its
+    block header (see :class:`BlockCache`). Any member may be None if the
+    node did not answer it in the batch, in which case the callback falls
+    back to a regular request. `tx` is only fetched for logs in
+    `INPUT_TOPICS`, everything else is in the receipt.
+    """
+    tx: Optional[TxData]
+    receipt: Optional[TxReceipt]
+
+
+class BlockHeader(NamedTuple):
+    number: int
+    hash: HexBytes
+    timestamp: int
+
+
+class BlockCache:
+    """
+    Bounded LRU of block headers for a single chain, keyed by block number
+    and validated against the log's block hash so a reorged block is never
+    served from cache.
+    """
+    def __init__(self, size: int = BLOCK_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._headers: 'OrderedDict[int, BlockHeader]' = OrderedDict()
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return (f'block cache {len(self._headers)}/{self.size} headers, '
+                f'{self.hits} hits, {self.misses} misses ({rate:.1f}% hit)')
+
+    def get(self, number: int, block_hash: HexBytes) -> Optional[BlockHeader]:
+        header = self._headers.get(number)
+
+        if header is None or header.hash != block_hash:
+            self.misses += 1
+            return None
+
+        self._headers.move_to_end(number)
+        self.hits += 1
+        return header
+
+    def put(self, header: BlockHeader) -> None:
+        self._headers[header.number] = header
+        self._headers.move_to_end(header.number)
+
+        while len(self._headers) > self.size:
+            self._headers.popitem(last=False)
+
+    def missing(self, logs: Iterable[LogReceipt]) -> List[int]:
+        """
+        Unique block numbers of `logs` that are absent or stale.
+        Does not count towards hits/misses.
+        """
+        res: Dict[int, None] = {}
+
+        for log in logs:
+            header = self._headers.get(log['blockNumber'])
+
+            if header is None or header.hash != log['blockHash']:
+                res[log['blockNumber']] = None
+
+        return list(res)
+
+
+BLOCK_CACHES: DefaultDict[str, BlockCache] = defaultdict(BlockCache)
+
+
+def to_header(block: BlockData) -> BlockHeader:
+    return BlockHeader(block['number'], block['hash'], block['timestamp'])
+
+
+def raw_to_header(block: Dict[str, str]) -> BlockHeader:
+    # Straight from the JSON, running the whole block formatter (and the POA
+    # `extraData` fixup) for 3 fields is a waste.
+    return BlockHeader(int(block['number'], 16), HexBytes(block['hash']),
+                       int(block['timestamp'], 16))
+
+
+def batch_request(w3: Web3,
+                  calls: List[Call],
+                  batch_size: int = RPC_BATCH_SIZE) -> List[Any]:
+    """
+    Send `calls` as JSON-RPC batches of at most `batch_size` requests.
+
+    Args:
+        w3 (Web3): the chain's web3 instance, batches go through its
+            endpoint pool, or its endpoint and request kwargs otherwise.
+        calls (List[Call]): list of `(method, params)`.
+        batch_size (int, optional): max requests per HTTP round trip.
+
+    Returns:
+        List[Any]: the raw results in the same order as `calls`, None where
+            the node returned an error or nothing at all.
+    """
+    provider = w3.provider
+    res: List[Any] = []
+
+    for i in range(0, len(calls), max(batch_size, 1)):
+        chunk = calls[i:i + batch_size]
+        payload = [{
+            'jsonrpc': '2.0',
+            'id': _id,
+            'method': method,
+            'params': params,
+        } for _id, (method, params) in enumerate(chunk)]
+
+        if isinstance(provider, PoolProvider):
+            raw = provider.post(json.dumps(payload).encode(), chunk)
+        else:
+            raw = make_post_request(
+                provider.endpoint_uri,  # type: ignore
+                json.dumps(payload).encode(),
+                **provider.get_request_kwargs(),  # type: ignore
+            )
+        resp = json.loads(raw)
+
+        # Nodes without batch support answer with a single error object.
+        if not isinstance(resp, list):
+            raise RuntimeError(f'batch request rejected: {resp}')
+
+        by_id = {r.get('id'): r for r in resp}
+        for _id in range(len(chunk)):
+            res.append(by_id.get(_id, {}).get('result'))
+
+    return res
+
+
+def get_block_header(chain: str, log: LogReceipt) -> BlockHeader:
+    """
+    Header of the block `log` was emitted in, from the chain's
+    :class:`BlockCache` or a single `eth_getBlockByNumber` on a miss.
+    """
+    cache = BLOCK_CACHES[chain]
+
+    if (header := cache.get(log['blockNumber'], log['blockHash'])) is None:
+        w3: Web3 = SYN_DATA[chain]['w3']
+        header = to_header(w3.eth.get_block(log['blockNumber']))
+        cache.put(header)
+
+    return header
+
+
+def supports_block_receipts(w3: Web3) -> bool:
+    """
+    Whether any endpoint of `w3`'s pool is not known to lack
+    `eth_getBlockReceipts`. Those that do are found out, and avoided, as the
+    method is sent (see :class:`PoolProvider`). Any other provider gets
+    per-transaction receipts.
+    """
+    provider = w3.provider
+    return isinstance(provider, PoolProvider) \
+        and provider.pool.supports('eth_getBlockReceipts')
+
+
+def enrich_logs(chain: str,
+                logs: List[LogReceipt],
+                batch_size: int = RPC_BATCH_SIZE) -> Dict[HexBytes, Enrichment]:
+    """
+    Fetch the receipts of every log in `logs`, and the transactions of the
+    few that need their input, with JSON-RPC batching rather than
+    sequential round trips per log. Receipts come one `eth_getBlockReceipts`
+    per block where the endpoint supports it, one `eth_getTransactionReceipt`
+    per transaction otherwise. Block headers not already cached are
+    prefetched into the chain's :class:`BlockCache` in the same batches,
+    once per unique block.
+
+    Returns:
+        Dict[HexBytes, Enrichment]: keyed by transaction hash.
+    """
+    if not logs:
+        return {}
+
+    w3: Web3 = SYN_DATA[chain]['w3']
+    cache = BLOCK_CACHES[chain]
+    blocks = cache.missing(logs)
+    tx_hashes = list(dict.fromkeys(log['transactionHash'] for log in logs))
+    with_input = list(
+        dict.fromkeys(log['transactionHash'] for log in logs
+                      if log['topics'][0].hex() in INPUT_TOPICS))
+
+    # Unique (number, hash) of the blocks the logs are in.
+    log_blocks = list(
+        dict.fromkeys((log['blockNumber'], log['blockHash']) for log in logs))
+    by_block = supports_block_receipts(w3)
+
+    calls: List[Call] = [('eth_getBlockByNumber', [hex(n), False])
+                         for n in blocks]
+    calls += [('eth_getTransactionByHash', [h.hex()]) for h in with_input]
+
+    if by_block:
+        calls += [('eth_getBlockReceipts', [hex(n)]) for n, _ in log_blocks]
+    else:
+        calls += [('eth_getTransactionReceipt', [h.hex()]) for h in tx_hashes]
+
+    ret = batch_request(w3, calls, batch_size)
+    _txs = ret[len(blocks):len(blocks) + len(with_input)]
+    _receipts = ret[len(blocks) + len(with_input):]
+
+    for block in ret[:len(blocks)]:
+        if block is not None:
+            cache.put(raw_to_header(block))
+
+    txs = {h: tx for h, tx in zip(with_input, _txs)}
+
+    if by_block:
+        wanted = {h.hex(): h for h in tx_hashes}
+        receipts: Dict[HexBytes, Any] = {}
+
+        for (_, block_hash), block_receipts in zip(log_blocks, _receipts):
+            for receipt in block_receipts or []:
+                tx_hash = wanted.get(receipt['transactionHash'].lower())
+
+                # A receipt of another fork of the block is no use.
+                if (tx_hash is not None and HexBytes(receipt['blockHash'])
+                        == block_hash):
+                    receipts[tx_hash] = receipt
+    else:
+        receipts = dict(zip(tx_hashes, _receipts))
+
+    res: Dict[HexBytes, Enrichment] = {}
+
+    for tx_hash in tx_hashes:
+        tx = txs.get(tx_hash)
+        receipt = receipts.get(tx_hash)
+
+        res[tx_hash] = Enrichment(
+            transaction_result_formatter(tx) if tx else None,
+            receipt_formatter(receipt) if receipt else None,
+        )
+
+    return res
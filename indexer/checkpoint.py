@@ -0,0 +1,133 @@
+from typing import Iterable, List, NamedTuple, Optional
+
+from web3.types import LogReceipt
+
+from indexer.data import LOGS_REDIS_URL
+
+# Legacy checkpoints only stored the transaction index, every log of that
+# transaction was processed.
+MAX_LOG_INDEX = 2 ** 31 - 1
+
+# Moves the cursor forward only: compares (block, tx index, log index)
+# lexicographically and writes all three fields at once, or nothing.
+_ADVANCE = LOGS_REDIS_URL.register_script("""
+local cur = redis.call(
+    'HMGET', KEYS[1], 'MAX_BLOCK_STORED', 'TX_INDEX', 'LOG_INDEX')
+
+if cur[1] then
+    for i = 1, 3 do
+        local new = tonumber(ARGV[i])
+        local old = tonumber(cur[i]) or -1
+
+        if new > old then
+            break
+        elseif new < old or i == 3 then
+            return 0
+        end
+    end
+end
+
+redis.call('HSET', KEYS[1], 'MAX_BLOCK_STORED', ARGV[1],
+           'TX_INDEX', ARGV[2], 'LOG_INDEX', ARGV[3])
+return 1
+""")
+
+
+class Cursor(NamedTuple):
+    block: int
+    tx_index: int
+    log_index: int
+
+    @classmethod
+    def from_log(cls, log: LogReceipt) -> 'Cursor':
+        return cls(log['blockNumber'], log['transactionIndex'],
+                   log['logIndex'])
+
+
+class CheckpointStore:
+    """
+    The last fully processed log of a chain/address, kept as a single redis
+    hash updated atomically and never moved backwards.
+    """
+    def __init__(self,
+                 chain: str,
+                 address: str,
+                 key_namespace: str = 'logs') -> None:
+        self._prefix = f'{chain}:{key_namespace}:{address}'
+        self.key = f'{self._prefix}:CURSOR'
+
+    def load(self) -> Optional[Cursor]:
+        ret = LOGS_REDIS_URL.hgetall(self.key)
+
+        if ret:
+            return Cursor(int(ret['MAX_BLOCK_STORED']), int(ret['TX_INDEX']),
+                          int(ret['LOG_INDEX']))
+
+        # Fall back to the two separate keys older versions wrote.
+        block = LOGS_REDIS_URL.get(f'{self._prefix}:MAX_BLOCK_STORED')
+        if block is None:
+            return None
+
+        tx_index = LOGS_REDIS_URL.get(f'{self._prefix}:TX_INDEX')
+        return Cursor(int(block), int(tx_index or -1), MAX_LOG_INDEX)
+
+    def save(self, cursor: Cursor) -> bool:
+        """
+        Returns:
+            bool: False if the stored cursor was already at or past `cursor`.
+        """
+        return bool(_ADVANCE(keys=[self.key], args=list(cursor)))
+
+    def rewind(self, cursor: Cursor) -> None:
+        """
+        Unconditionally move the cursor to `cursor`, e.g. back to the fork
+        point after a reorg. Use :meth:`save` for everything else.
+        """
+        LOGS_REDIS_URL.hset(self.key,
+                            mapping=dict(
+                                zip(('MAX_BLOCK_STORED', 'TX_INDEX',
+                                     'LOG_INDEX'), cursor)))
+
+
+class SeenLogs:
+    """
+    `(blockHash, logIndex)` of every log processed past the checkpoint of a
+    chain/address, kept as a redis sorted set scored by block number. Logs
+    can complete out of order and ahead of the checkpoint, this is what
+    keeps them from being processed twice after a restart or a handover.
+    """
+    def __init__(self,
+                 chain: str,
+                 address: str,
+                 key_namespace: str = 'logs') -> None:
+        self.key = f'{chain}:{key_namespace}:{address}:SEEN'
+
+    @staticmethod
+    def _member(log: LogReceipt) -> str:
+        return f'{log["blockHash"].hex()}:{log["logIndex"]}'
+
+    def unseen(self, logs: List[LogReceipt]) -> List[LogReceipt]:
+        if not logs:
+            return logs
+
+        pipe = LOGS_REDIS_URL.pipeline(transaction=False)
+        for log in logs:
+            pipe.zscore(self.key, self._member(log))
+
+        return [
+            log for log, score in zip(logs, pipe.execute()) if score is None
+        ]
+
+    def add(self, logs: Iterable[LogReceipt]) -> None:
+        mapping = {self._member(log): log['blockNumber'] for log in logs}
+
+        if mapping:
+            LOGS_REDIS_URL.zadd(self.key, mapping)
+
+    def forget(self, from_block: int) -> None:
+        """Drop logs at or after `from_block`, they were reorged out."""
+        LOGS_REDIS_URL.zremrangebyscore(self.key, from_block, '+inf')
+
+    def trim(self, before_block: int) -> None:
+        """Drop logs before `before_block`, the checkpoint covers them."""
+        LOGS_REDIS_URL.zremrangebyscore(self.key, '-inf', f'({before_block}')
@@ -3,7 +3,7 @@ from collections import defaultdict
 from dataclasses import dataclass
 from hexbytes import HexBytes
 
-import web3.exceptions
+from web3.contract import Contract
 from web3 import Web3
 
 _pool_cache: Dict[str, Dict[str, List[str]]] = defaultdict(dict)
@@ -30,6 +30,36 @@ def call_abi(data, key: str, func_name: str, *args, **kwargs) -> Any:
                                                    **kwargs).call(**call_args)
 
 
+def get_pool_tokens(chain: str,
+                    contract: Contract,
+                    max_index: Optional[int] = None,
+                    chunk: int = 16) -> List[str]:
+    """
+    Call `getToken` from index 0 till the first failure or `max_index`,
+    `chunk` indexes at a time through a single aggregated `eth_call`.
+    """
+    from indexer.data import MAX_UINT8
+    from indexer.multicall import aggregate
+
+    max_index = max_index or MAX_UINT8
+    res: List[str] = []
+
+    for start in range(0, max_index, chunk):
+        ret = aggregate(chain, [
+            contract.functions.getToken(i)
+            for i in range(start, min(start + chunk, max_index))
+        ])
+
+        for success, token in ret:
+            if not success:
+                # Out of range.
+                return res
+
+            res.append(token)
+
+    return res
+
+
 def get_all_tokens_in_pool(chain: str,
                            max_index: Optional[int] = None,
                            func: str = 'nusdpool_contract') -> List[str]:
@@ -45,22 +75,11 @@ def get_all_tokens_in_pool(chain: str,
     Returns:
         List[str]: list of token addresses
     """
-    from indexer.data import SYN_DATA, MAX_UINT8
+    from indexer.data import SYN_DATA
 
     assert (chain in SYN_DATA)
 
-    data = SYN_DATA[chain]
-    res: List[str] = []
-
-    for i in range(max_index or MAX_UINT8):
-        try:
-            res.append(call_abi(data, func, 'getToken', i))
-        except (web3.exceptions.ContractLogicError,
-                web3.exceptions.BadFunctionCallOutput):
-            # Out of range.
-            break
-
-    return res
+    return get_pool_tokens(chain, SYN_DATA[chain][func], max_index)
 
 
 def get_bridge_token_info(chain_id: int,
@@ -88,20 +107,12 @@ def get_pool_data(chain: str, address: str):
     if address in _pool_cache[chain]:
         return _pool_cache[chain][address]
 
-    from indexer.data import MAX_UINT8, SYN_DATA, BASEPOOL_ABI
+    from indexer.data import SYN_DATA, BASEPOOL_ABI
 
     w3: Web3 = SYN_DATA[chain]['w3']
     contract = w3.eth.contract(w3.toChecksumAddress(address), abi=BASEPOOL_ABI)
-    res: List[str] = []
-
-    for i in range(MAX_UINT8):
-        try:
-            # TODO: block identifier?
-            res.append(contract.functions.getToken(i).call())
-        except (web3.exceptions.ContractLogicError,
-                web3.exceptions.BadFunctionCallOutput):
-            # Out of range.
-            break
+    # TODO: block identifier?
+    res = get_pool_tokens(chain, contract)
 
     _pool_cache[chain][address] = res
     return res
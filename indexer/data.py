@@ -1,4 +1,5 @@
-from typing import Dict, List, Literal, TypedDict, DefaultDict, cast
+from typing import Any, Dict, List, Literal, Optional, TypedDict, \
+    DefaultDict, cast
 from collections import defaultdict
 from enum import Enum
 import json
@@ -11,12 +12,16 @@ from dotenv import load_dotenv, find_dotenv
 from gevent.greenlet import Greenlet
 from web3.contract import Contract
 from hexbytes import HexBytes
-from gevent.pool import Pool
+from gevent.lock import Semaphore
+from gevent import monkey
 from web3 import Web3
 import gevent
 import redis
 
 from indexer.contract import get_all_tokens_in_pool
+from indexer.endpoints import PoolProvider
+from indexer.multicall import aggregate
+from indexer.snapshot import load_snapshot, save_snapshot
 
 # If `.env` exists, let it override the sample env file.
 load_dotenv(find_dotenv('.env.sample'))
@@ -25,6 +30,20 @@ load_dotenv(override=True)
 TESTING = "pytest" in sys.modules or os.getenv('TESTING')
 if TESTING: print('Running with TESTING mode enabled.')
 
+# `main.py` patches sockets before importing us; if it did not, every RPC,
+# Redis and Mongo call below blocks the hub and chains index serially.
+if not monkey.is_module_patched('socket'):
+    print('gevent has not patched sockets, I/O will be serialized.')
+
+# Max requests per JSON-RPC batch when enriching `get_logs` pages, 0 turns
+# batching off and every log is enriched with its own requests.
+RPC_BATCH_SIZE = int(os.getenv('RPC_BATCH_SIZE', 50))
+# Max block headers kept per chain to share timestamps between events.
+BLOCK_CACHE_SIZE = int(os.getenv('BLOCK_CACHE_SIZE', 4096))
+# `get_logs` windows fetched and enriched ahead of the one being processed,
+# 0 fetches each once the previous one is processed.
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', 2))
+
 """
 Setup Redis
 """
@@ -73,96 +92,183 @@ Chain names mapped to synapse bridges and pools
 SYN_DATA = {
     "ethereum": {
         "rpc": os.getenv('ETH_RPC'),
+        "ws": os.getenv('ETH_WS'),
         "bridge": "0x2796317b0ff8538f253012862c06787adfb8ceb6",
         "nusdpool": "0x1116898DdA4015eD8dDefb84b6e8Bc24528Af2d8",
     },
         "avalanche": {
         "rpc": os.getenv('AVAX_RPC'),
+        "ws": os.getenv('AVAX_WS'),
         "bridge": "0xc05e61d0e7a63d27546389b7ad62fdff5a91aace",
         "nusdpool": "0xed2a7edd7413021d440b09d654f3b87712abab66",
         "nethpool": "0x77a7e60555bC18B4Be44C181b2575eee46212d44",
     },
     "bsc": {
         "rpc": os.getenv('BSC_RPC'),
+        "ws": os.getenv('BSC_WS'),
         "bridge": "0xd123f70ae324d34a9e76b67a27bf77593ba8749f",
         "nusdpool": "0x28ec0b36f0819ecb5005cab836f4ed5a2eca4d13",
     },
     "polygon": {
         "rpc": os.getenv('POLYGON_RPC'),
+        "ws": os.getenv('POLYGON_WS'),
         "bridge": "0x8f5bbb2bb8c2ee94639e55d5f41de9b4839c1280",
         "nusdpool": "0x85fcd7dd0a1e1a9fcd5fd886ed522de8221c3ee5",
     },
     "arbitrum": {
         "rpc": os.getenv('ARB_RPC'),
+        "ws": os.getenv('ARB_WS'),
         "bridge": "0x6f4e8eba4d337f874ab57478acc2cb5bacdc19c9",
         "nusdpool": "0x0db3fe3b770c95a0b99d1ed6f2627933466c0dd8",
         "nethpool": "0xa067668661c84476afcdc6fa5d758c4c01c34352",
     },
     "fantom": {
         "rpc": os.getenv('FTM_RPC'),
+        "ws": os.getenv('FTM_WS'),
         "bridge": "0xaf41a65f786339e7911f4acdad6bd49426f2dc6b",
         "nusdpool": "0x2913e812cf0dcca30fb28e6cac3d2dcff4497688",
         "nethpool": "0x8d9ba570d6cb60c7e3e0f31343efe75ab8e65fb1",
     },
     "harmony": {
         "rpc": os.getenv('HARMONY_RPC'),
+        "ws": os.getenv('HARMONY_WS'),
         "bridge": "0xaf41a65f786339e7911f4acdad6bd49426f2dc6b",
         "nusdpool": "0x3ea9b0ab55f34fb188824ee288ceaefc63cf908e",
         "nethpool": "0x2913e812cf0dcca30fb28e6cac3d2dcff4497688",
     },
     "boba": {
         "rpc": os.getenv('BOBA_RPC'),
+        "ws": os.getenv('BOBA_WS'),
         "bridge": "0x432036208d2717394d2614d6697c46df3ed69540",
         "nusdpool": "0x75ff037256b36f15919369ac58695550be72fead",
         "nethpool": "0x753bb855c8fe814233d26bb23af61cb3d2022be5",
     },
     "moonriver": {
         "rpc": os.getenv('MOVR_RPC'),
+        "ws": os.getenv('MOVR_WS'),
         "bridge": "0xaed5b25be1c3163c907a471082640450f928ddfe",
     },
     "optimism": {
         "rpc": os.getenv('OPTIMISM_RPC'),
+        "ws": os.getenv('OPTIMISM_WS'),
         "bridge": "0xaf41a65f786339e7911f4acdad6bd49426f2dc6b",
         "nethpool": "0xe27bff97ce92c3e1ff7aa9f86781fdd6d48f5ee9",
     },
     "aurora": {
         "rpc": os.getenv('AURORA_RPC'),
+        "ws": os.getenv('AURORA_WS'),
         "bridge": "0xaed5b25be1c3163c907a471082640450f928ddfe",
         "nusdpool": "0xcef6c2e20898c2604886b888552ca6ccf66933b0",
     },
     "moonbeam": {
         "rpc": os.getenv('MOONBEAM_RPC'),
+        "ws": os.getenv('MOONBEAM_WS'),
         'bridge': '0x84a420459cd31c3c34583f67e0f0fb191067d32f',
     },
     "cronos": {
         "rpc": os.getenv('CRONOS_RPC'),
+        "ws": os.getenv('CRONOS_WS'),
         "bridge": "0xe27bff97ce92c3e1ff7aa9f86781fdd6d48f5ee9",
     },
     "metis": {
         "rpc": os.getenv('METIS_RPC'),
+        "ws": os.getenv('METIS_WS'),
         "bridge": "0x06fea8513ff03a0d3f61324da709d4cf06f42a5c",
     },
     "dfk": {
         "rpc": os.getenv('DFK_RPC'),
+        "ws": os.getenv('DFK_WS'),
         "bridge": "0xe05c976d3f045d0e6e7a6f61083d98a15603cf6a",
     },
 }
 
+# Chains this process ingests, set per worker by `supervisor.py` (e.g.
+# `INDEXER_CHAINS=ethereum,bsc`), all of them by default.
+INDEXER_CHAINS: List[str] = [
+    chain for chain in os.getenv('INDEXER_CHAINS', '').split(',') if chain
+] or list(SYN_DATA)
+if (unknown := set(INDEXER_CHAINS) - set(SYN_DATA)):
+    raise ValueError(f'unknown INDEXER_CHAINS: {", ".join(sorted(unknown))}')
+
+# How many logs of a `get_logs` window are processed at once, per chain.
+# `CALLBACK_CONCURRENCY` is the default, `<CHAIN>_CONCURRENCY` overrides it.
+CALLBACK_CONCURRENCY: Dict[str, int] = {
+    chain: int(
+        os.getenv(f'{chain.upper()}_CONCURRENCY',
+                  os.getenv('CALLBACK_CONCURRENCY', 8)))
+    for chain in SYN_DATA
+}
+
+# Requests per second and requests at once allowed per RPC endpoint, per
+# chain. `RPC_RATE` and `RPC_MAX_INFLIGHT` are the defaults, `<CHAIN>_RPC_RATE`
+# and `<CHAIN>_RPC_MAX_INFLIGHT` override them. A rate of 0 is unlimited until
+# the endpoint answers 429, from then on it adapts (see `indexer.endpoints`).
+RPC_RATES: Dict[str, Optional[float]] = {
+    chain: float(
+        os.getenv(f'{chain.upper()}_RPC_RATE', os.getenv('RPC_RATE', 0)))
+    or None
+    for chain in SYN_DATA
+}
+RPC_MAX_INFLIGHT: Dict[str, int] = {
+    chain: int(
+        os.getenv(f'{chain.upper()}_RPC_MAX_INFLIGHT',
+                  os.getenv('RPC_MAX_INFLIGHT', 32)))
+    for chain in SYN_DATA
+}
+
+# Blocks a log must be buried under before the live path processes it, and
+# the rough block time in seconds the head is polled at. Overridden with
+# `<CHAIN>_CONFIRMATIONS` and `<CHAIN>_BLOCK_TIME`.
+_follow_defaults = {
+    'ethereum': (12, 12),
+    'avalanche': (1, 2),
+    'bsc': (15, 3),
+    'polygon': (64, 2),
+    'arbitrum': (0, 1),
+    'fantom': (2, 1),
+    'harmony': (2, 2),
+    'boba': (0, 1),
+    'moonriver': (2, 12),
+    'optimism': (0, 2),
+    'aurora': (2, 1),
+    'moonbeam': (2, 12),
+    'cronos': (2, 6),
+    'metis': (0, 4),
+    'dfk': (1, 2),
+}
+CONFIRMATIONS: Dict[str, int] = {
+    chain: int(
+        os.getenv(f'{chain.upper()}_CONFIRMATIONS',
+                  _follow_defaults[chain][0]))
+    for chain in SYN_DATA
+}
+BLOCK_TIMES: Dict[str, float] = {
+    chain: float(
+        os.getenv(f'{chain.upper()}_BLOCK_TIME', _follow_defaults[chain][1]))
+    for chain in SYN_DATA
+}
+# Recent blocks whose hashes are kept to notice (and undo) reorgs deeper
+# than `CONFIRMATIONS`.
+REORG_DEPTH = int(os.getenv('REORG_DEPTH', 128))
+# Once the checkpoint is this close to the confirmed head, a chain switches
+# from catching up with `get_logs` to following the head.
+FOLLOW_DISTANCE = int(os.getenv('FOLLOW_DISTANCE', 1000))
+
 # Init 'func' to append `contract` to SYN_DATA so we can call the ABI simpler later.
+# Building these does no I/O, endpoints are first contacted by `connect`.
+# `<CHAIN>_RPC` may list several endpoints separated by commas, requests are
+# balanced and failed over between them (see `indexer.endpoints`).
 for key, value in SYN_DATA.items():
-    w3 = Web3(Web3.HTTPProvider(value['rpc']))
-    assert w3.isConnected(), key
+    w3 = Web3(
+        PoolProvider(key, [
+            url.strip() for url in (value['rpc'] or '').split(',')
+            if url.strip()
+        ], RPC_RATES[key], RPC_MAX_INFLIGHT[key]))
 
     if key != 'ethereum':
         w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
     w3.middleware_onion.add(local_filter_middleware)
-    print(key)
-    try:
-        print(w3.eth.syncing)
-    except Exception as e:
-        print(e)
-
     value.update({'w3': w3})
 
     if value.get('nusdpool') is not None:
@@ -180,6 +286,30 @@ for key, value in SYN_DATA.items():
         })
 
 
+class Health(Enum):
+    def __str__(self) -> str:
+        return self.name
+
+    PENDING = 0
+    CONNECTING = 1
+    HEALTHY = 2
+    DEGRADED = 3
+
+
+class ChainHealth(TypedDict):
+    health: Health
+    error: Optional[str]
+
+
+#: Per chain connection state, a chain stuck in DEGRADED does not hold up
+#: any other chain.
+CHAIN_HEALTH: Dict[str, ChainHealth] = {
+    chain: ChainHealth(health=Health.PENDING, error=None)
+    for chain in SYN_DATA
+}
+__connect_locks = {chain: Semaphore() for chain in SYN_DATA}
+
+
 """
 In a bridging scenario, there are txns out of a chain and into a chain
 We track direction as sometimes, due to RPC lag etc, OUT transactions
@@ -524,49 +654,9 @@ class TokenInfo(TypedDict):
 
 
 TOKENS_INFO: Dict[str, Dict[str, TokenInfo]] = defaultdict(dict)
-__jobs: List[Greenlet] = []
-
-
-def __cb(w3: Web3, chain: str, token: str) -> None:
-    contract = w3.eth.contract(w3.toChecksumAddress(token), abi=ERC20_BARE_ABI)
-
-    decimals = contract.functions.decimals().call()
-    name = contract.functions.name().call()
-    symbol = contract.functions.symbol().call()
-
-    TOKENS_INFO[chain].update({
-        token.lower():
-            TokenInfo(_contract=contract,
-                      name=name,
-                      symbol=symbol,
-                      decimals=decimals)
-    })
-
-
-__pool = Pool(size=24)
-for chain, tokens in TOKENS.items():
-    w3: Web3 = SYN_DATA[chain]['w3']
-
-    for token in tokens:
-        assert token not in TOKENS_INFO[chain], \
-            f'duped token? {token} @ {chain} | {TOKENS_INFO[chain][token]}'
-
-        __jobs.append(__pool.spawn(__cb, w3, chain, token))
-
-gevent.joinall(__jobs, raise_error=True)
-
 TOKEN_DECIMALS: Dict[str, Dict[str, int]] = defaultdict(dict)
 TOKEN_SYMBOLS: Dict[str, Dict[str, str]] = defaultdict(dict)
 
-# `TOKEN_DECIMALS` is an abstraction of `TOKENS_INFO`.
-for chain, v in TOKENS_INFO.items():
-    for token, data in v.items():
-        assert token not in TOKEN_DECIMALS[chain], \
-            f'duped token? {token} @ {chain} | {TOKEN_DECIMALS[chain][token]}'
-
-        TOKEN_SYMBOLS[chain].update({token: data['symbol']})
-        TOKEN_DECIMALS[chain].update({token: data['decimals']})
-
 _TKS = DefaultDict[str, Dict[Literal['nusd', 'neth'], Dict[int, str]]]
 #: Example schema:
 #: {'arbitrum':
@@ -578,18 +668,230 @@ _TKS = DefaultDict[str, Dict[Literal['nusd', 'neth'], Dict[int, str]]]
 #:             3: '0xFd086bC7CD5C481DCC9C85ebE478A1C0b69FCbb9'}}
 TOKENS_IN_POOL: _TKS = defaultdict(lambda: defaultdict(dict))
 
-for chain, v in SYN_DATA.items():
-    if 'nusdpool_contract' in v:
-        ret = get_all_tokens_in_pool(chain)
+"""
+Token and pool metadata, loaded from an on-disk snapshot when possible and
+only fetched from chain for whatever the snapshot is missing.
+"""
+METADATA_VERSION = 1
+METADATA_SNAPSHOT = os.getenv(
+    'METADATA_SNAPSHOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata.json'))
+METADATA_REFRESH_SECONDS = int(os.getenv('METADATA_REFRESH_SECONDS', 6 * 3600))
+
+_Metadata = Dict[str, Dict[str, Dict[str, Any]]]
+# Everything applied so far, this is what gets written to the snapshot.
+__metadata: _Metadata = {'tokens': defaultdict(dict), 'pools': defaultdict(dict)}
+__snapshot: Optional[_Metadata] = None
+
+
+def __cb(w3: Web3, chain: str, _tokens: List[str],
+         tokens: Dict[str, Any]) -> None:
+    contracts = [
+        w3.eth.contract(w3.toChecksumAddress(token), abi=ERC20_BARE_ABI)
+        for token in _tokens
+    ]
+
+    # decimals, name and symbol of every token in as few calls as possible.
+    ret = aggregate(chain, [
+        fn for contract in contracts for fn in (
+            contract.functions.decimals(),
+            contract.functions.name(),
+            contract.functions.symbol(),
+        )
+    ], allow_failure=False)
+
+    for i, token in enumerate(_tokens):
+        decimals, name, symbol = (r.value for r in ret[3 * i:3 * i + 3])
+
+        tokens[token.lower()] = {
+            'name': name,
+            'symbol': symbol,
+            'decimals': decimals,
+        }
+
+
+def __pool_cb(chain: str, key: Literal['nusd', 'neth'],
+              pools: Dict[str, Any]) -> None:
+    pools[key] = {
+        'address': SYN_DATA[chain][f'{key}pool'].lower(),
+        'tokens': get_all_tokens_in_pool(chain, func=f'{key}pool_contract'),
+    }
+
+
+def fetch_metadata(chain: str,
+                   known: Optional[_Metadata] = None) -> _Metadata:
+    """
+    Metadata of every token in `TOKENS` and every pool in `SYN_DATA` of
+    `chain`, taking entries from `known` (a snapshot) as is and fetching the
+    rest from chain.
+    """
+    known = known or {}
+    w3: Web3 = SYN_DATA[chain]['w3']
+    tokens: Dict[str, Any] = {}
+    pools: Dict[str, Any] = {}
+    jobs: List[Greenlet] = []
+    missing: List[str] = []
+
+    for token in TOKENS.get(chain, []):
+        assert token.lower() not in tokens \
+            and token.lower() not in map(str.lower, missing), \
+            f'duped token? {token} @ {chain}'
+
+        if (ret := known.get('tokens', {}).get(chain, {}).get(
+                token.lower())) is not None:
+            tokens[token.lower()] = ret
+        else:
+            missing.append(token)
+
+    if missing:
+        jobs.append(gevent.spawn(__cb, w3, chain, missing, tokens))
+
+    for key in ('nusd', 'neth'):
+        if f'{key}pool_contract' not in SYN_DATA[chain]:
+            continue
+
+        ret = known.get('pools', {}).get(chain, {}).get(key)
+        # Only trust the snapshot if the pool itself did not change.
+        if (ret is not None
+                and ret['address'] == SYN_DATA[chain][f'{key}pool'].lower()):
+            pools[key] = ret
+        else:
+            jobs.append(gevent.spawn(__pool_cb, chain, key, pools))
+
+    gevent.joinall(jobs, raise_error=True)
+    return {'tokens': {chain: tokens}, 'pools': {chain: pools}}
+
+
+def apply_metadata(metadata: _Metadata) -> bool:
+    """
+    Update `TOKENS_INFO`, `TOKEN_DECIMALS`, `TOKEN_SYMBOLS` and
+    `TOKENS_IN_POOL` in place so modules that imported them see the change.
+
+    Returns:
+        bool: whether anything differs from what was applied before.
+    """
+    changed = False
+
+    for chain, v in metadata['tokens'].items():
+        w3: Web3 = SYN_DATA[chain]['w3']
+
+        for token, data in v.items():
+            if (old := __metadata['tokens'][chain].get(token)) == data:
+                continue
+            elif old is not None:
+                print(f'{token} @ {chain} changed: {old} -> {data}')
+
+            changed = True
+            __metadata['tokens'][chain][token] = data
+
+            if token not in TOKENS_INFO[chain]:
+                TOKENS_INFO[chain][token] = TokenInfo(
+                    _contract=w3.eth.contract(w3.toChecksumAddress(token),
+                                              abi=ERC20_BARE_ABI),
+                    name=data['name'],
+                    symbol=data['symbol'],
+                    decimals=data['decimals'])
+            else:
+                TOKENS_INFO[chain][token].update(name=data['name'],
+                                                 symbol=data['symbol'],
+                                                 decimals=data['decimals'])
+
+            # `TOKEN_DECIMALS` is an abstraction of `TOKENS_INFO`.
+            TOKEN_SYMBOLS[chain][token] = data['symbol']
+            TOKEN_DECIMALS[chain][token] = data['decimals']
+
+    for chain, v in metadata['pools'].items():
+        for key, data in v.items():
+            if __metadata['pools'][chain].get(key) == data:
+                continue
+
+            changed = True
+            __metadata['pools'][chain][key] = data
+            TOKENS_IN_POOL[chain][key].clear()
+            TOKENS_IN_POOL[chain][key].update(enumerate(data['tokens']))
+
+    return changed
+
+
+def load_metadata(chain: str) -> None:
+    """
+    Apply the snapshot's metadata for `chain` and fetch only what it is
+    missing, rewriting the snapshot if anything had to be fetched.
+    """
+    global __snapshot
+
+    if __snapshot is None:
+        __snapshot = load_snapshot(METADATA_SNAPSHOT, METADATA_VERSION) or {}
+
+    metadata = fetch_metadata(chain, __snapshot)
+    apply_metadata(metadata)
+
+    if any(metadata[k][chain] != __snapshot.get(k, {}).get(chain, {})
+           for k in metadata):
+        save_metadata()
+
+
+def save_metadata() -> None:
+    # Only the chains loaded here, the snapshot keeps every other chain as
+    # other workers last saved it.
+    save_snapshot(METADATA_SNAPSHOT,
+                  METADATA_VERSION,
+                  __metadata,
+                  merge=True)
+
+
+def connect(chain: str, max_delay: float = 60) -> Web3:
+    """
+    Block the calling greenlet until `chain`'s endpoint answers and its
+    metadata is loaded, probing with a backoff meanwhile. Cheap once the
+    chain is HEALTHY, every ingestion entry point calls it first.
+    """
+    state = CHAIN_HEALTH[chain]
+    w3: Web3 = SYN_DATA[chain]['w3']
+
+    with __connect_locks[chain]:
+        delay = 1.0
+
+        while state['health'] != Health.HEALTHY:
+            state['health'] = Health.CONNECTING
+
+            try:
+                if not w3.isConnected():
+                    raise ConnectionError(f'{w3.provider} is not reachable')
+
+                load_metadata(chain)
+                state.update(health=Health.HEALTHY, error=None)
+                print(f'[{chain}] connected, head at {w3.eth.block_number}')
+            except Exception as e:
+                state.update(health=Health.DEGRADED, error=str(e))
+                print(f'[{chain}] degraded, retrying in {delay:.0f}s: {e}')
+                gevent.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    return w3
+
+
+def refresh_metadata(interval: int = METADATA_REFRESH_SECONDS) -> None:
+    """
+    Periodically reconcile the snapshot against chain, meant to be spawned.
+    """
+    while True:
+        gevent.sleep(interval)
+        changed = False
+
+        for chain in SYN_DATA:
+            if CHAIN_HEALTH[chain]['health'] != Health.HEALTHY:
+                continue
 
-        for i, token in enumerate(ret):
-            TOKENS_IN_POOL[chain]['nusd'].update({i: token})
+            try:
+                changed |= apply_metadata(fetch_metadata(chain))
+            except Exception as e:
+                print(f'[{chain}] failed to refresh metadata: {e}')
 
-    if 'nethpool_contract' in v:
-        ret = get_all_tokens_in_pool(chain, func='nethpool_contract')
+        if changed:
+            save_metadata()
+            print('refreshed metadata snapshot')
 
-        for i, token in enumerate(ret):
-            TOKENS_IN_POOL[chain]['neth'].update({i: token})
 
 POOLS: Dict[str, Dict[Literal['nusd', 'neth'], str]] = {
     'ethereum': {
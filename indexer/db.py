@@ -1,10 +1,53 @@
+from typing import Any, Dict, List, Optional
+import time
 import pymongo
 import os
 from urllib.parse import quote_plus
 
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from gevent.lock import RLock
+import gevent
+
+# Flush queued writes once this many are pending or this old.
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', 500))
+MONGO_FLUSH_SECONDS = float(os.getenv('MONGO_FLUSH_SECONDS', 1))
+
+DUPLICATE_KEY = 11000
+
+# Bump whenever `TRANSACTION_INDEXES` changes, startup rebuilds on mismatch.
+INDEXES_VERSION = 1
+TRANSACTION_INDEXES = [
+    IndexModel([('kappa', ASCENDING)], name='kappa', unique=True),
+    IndexModel([('from_tx_hash', ASCENDING)], name='from_tx_hash'),
+    IndexModel([('to_tx_hash', ASCENDING)], name='to_tx_hash'),
+    IndexModel([('from_address', ASCENDING), ('sent_time', DESCENDING)],
+               name='from_address_sent_time'),
+    IndexModel([('to_address', ASCENDING), ('received_time', DESCENDING)],
+               name='to_address_received_time'),
+    IndexModel([('from_chain_id', ASCENDING), ('sent_time', DESCENDING)],
+               name='from_chain_id_sent_time'),
+    IndexModel([('to_chain_id', ASCENDING), ('received_time', DESCENDING)],
+               name='to_chain_id_received_time'),
+    IndexModel([('pending', ASCENDING), ('sent_time', DESCENDING)],
+               name='pending_sent_time'),
+]
+
+# Fields each side of a kappa sets, see `bridge_callback`. `to_address` and
+# `to_chain_id` are written by both so they are never rolled back.
+OUT_FIELDS = ('from_tx_hash', 'from_address', 'sent_value',
+              'sent_value_formatted', 'from_chain_id', 'sent_time',
+              'sent_token', 'sent_token_symbol')
+IN_FIELDS = ('to_tx_hash', 'received_value', 'received_value_formatted',
+             'received_time', 'received_token', 'received_token_symbol',
+             'swap_success')
+
 
 class MongoManager:
     __instance = None
+    __writer: Optional['BulkWriter'] = None
 
     @staticmethod
     def get_db_instance():
@@ -12,6 +55,13 @@ class MongoManager:
             MongoManager()
         return MongoManager.__instance
 
+    @staticmethod
+    def get_bulk_writer() -> 'BulkWriter':
+        if MongoManager.__writer is None:
+            MongoManager.__writer = BulkWriter(
+                MongoManager.get_db_instance().transactions)
+        return MongoManager.__writer
+
     def __init__(self):
         if MongoManager.__instance is not None:
             raise Exception("Error. Cannot re-instantiate a singleton")
@@ -27,3 +77,197 @@ class MongoManager:
                     f"{quote_plus(os.environ['MONGO_PASSWORD'])}@"
                     f"{os.environ['MONGO_HOST']}:27017/{os.environ['MONGO_DB_NAME']}"
                 )[os.environ['MONGO_DB_NAME']]
+
+
+class BulkWriter:
+    """
+    Queues idempotent upserts keyed on `kappa` and writes them with unordered
+    `bulk_write` calls, by size, by age or when explicitly flushed (e.g. right
+    before a checkpoint is saved). Age is checked by a greenlet spawned with
+    the first upsert, so the last few ops don't wait for another upsert.
+    """
+    def __init__(self,
+                 collection: Collection,
+                 size: int = MONGO_BATCH_SIZE,
+                 interval: float = MONGO_FLUSH_SECONDS) -> None:
+        self.collection = collection
+        self.size = size
+        self.interval = interval
+        self._ops: List[UpdateOne] = []
+        self._last_flush = time.time()
+        self._lock = RLock()
+        self._flusher: Optional[gevent.Greenlet] = None
+
+    def upsert(self,
+               kappa: str,
+               update: Dict[str, Any],
+               on_insert: Optional[Dict[str, Any]] = None) -> None:
+        doc: Dict[str, Any] = {'$set': update}
+        if on_insert:
+            doc['$setOnInsert'] = on_insert
+
+        self._ops.append(UpdateOne({'kappa': kappa}, doc, upsert=True))
+
+        if self._flusher is None and self.interval > 0:
+            self._flusher = gevent.spawn(self._flush_forever)
+
+        if (len(self._ops) >= self.size
+                or time.time() - self._last_flush >= self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write everything queued so far. On failure the ops are queued
+        again and the error is raised, nothing is silently dropped.
+        """
+        with self._lock:
+            ops, self._ops = self._ops, []
+            self._last_flush = time.time()
+
+            if not ops:
+                return
+
+            try:
+                ret = self._write(ops)
+            except Exception:
+                self._ops[:0] = ops
+                raise
+
+            print(f'Flushed {len(ops)} transactions to DB: '
+                  f'{ret.upserted_count} inserted, '
+                  f'{ret.modified_count} updated')
+
+    def _flush_forever(self) -> None:
+        while True:
+            due = self._last_flush + self.interval
+            gevent.sleep(max(due - time.time(), 0))
+
+            # Flushed by an upsert or a checkpoint meanwhile, if not due.
+            if time.time() - self._last_flush < self.interval:
+                continue
+
+            try:
+                self.flush()
+            except Exception as e:
+                # Queued again, the next flush retries them.
+                print(f'periodic flush failed: {e}')
+
+    def _write(self, ops: List[UpdateOne]):
+        try:
+            return self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+
+            # Two upserts of a new kappa raced and the unique index rejected
+            # one, running it again now matches the document instead.
+            if any(err['code'] != DUPLICATE_KEY for err in errors):
+                raise
+
+            return self.collection.bulk_write(
+                [ops[err['index']] for err in errors], ordered=False)
+
+
+def _report_index_builds(db: Database, interval: float = 5) -> None:
+    while True:
+        gevent.sleep(interval)
+
+        try:
+            ops = db.client.admin.aggregate([
+                {'$currentOp': {}},
+                {'$match': {'command.createIndexes': 'transactions'}},
+            ])
+        except OperationFailure as e:
+            print(f'cannot report index build progress: {e}')
+            return
+
+        for op in ops:
+            progress = op.get('progress', {})
+            print(f'index build: {op.get("msg", "in progress")} '
+                  f'({progress.get("done", "?")}/{progress.get("total", "?")})')
+
+
+def ensure_indexes(db: Optional[Database] = None) -> None:
+    """
+    Idempotently build `TRANSACTION_INDEXES` on the transactions collection.
+    The applied version and index names are kept in `meta`, indexes that an
+    older version created but the current one dropped are removed.
+    """
+    db = db if db is not None else MongoManager.get_db_instance()
+    meta = db.meta.find_one({'_id': 'indexes'}) or {}
+    existing = db.transactions.index_information()
+    names = [i.document['name'] for i in TRANSACTION_INDEXES]
+
+    if (meta.get('version') == INDEXES_VERSION
+            and all(name in existing for name in names)):
+        return
+
+    for name in meta.get('names', []):
+        if name not in names and name in existing:
+            print(f'dropping stale index {name}')
+            db.transactions.drop_index(name)
+
+    print(f'building transaction indexes v{INDEXES_VERSION}: {names}')
+    reporter = gevent.spawn(_report_index_builds, db)
+    _start = time.time()
+
+    try:
+        db.transactions.create_indexes(TRANSACTION_INDEXES)
+    except OperationFailure as e:
+        # Most likely duplicated kappas written before upserts, leave the
+        # version unset so the next start tries again once they are cleaned.
+        print(f'failed to build transaction indexes: {e}')
+        return
+    finally:
+        reporter.kill()
+
+    sizes = db.command('collStats', 'transactions')['indexSizes']
+    for name in names:
+        print(f'index {name}: {sizes.get(name, 0) / 2 ** 20:.1f}MiB')
+
+    db.meta.update_one(
+        {'_id': 'indexes'},
+        {'$set': {
+            'version': INDEXES_VERSION,
+            'names': names
+        }},
+        upsert=True,
+    )
+    print(f'transaction indexes v{INDEXES_VERSION} ready in '
+          f'{time.time() - _start:.1f}s')
+
+
+def rollback(chain_id: int, out_txs: List[str], in_txs: List[str]) -> int:
+    """
+    Undo what the logs of `out_txs` (sent from `chain_id`) and `in_txs`
+    (received on it) wrote, after their blocks were reorged out. A kappa
+    left with neither side is deleted, one with only its OUT side left is
+    pending again.
+
+    Returns:
+        int: documents deleted.
+    """
+    collection = MongoManager.get_db_instance().transactions
+    # Anything still queued for these must land before it is undone.
+    MongoManager.get_bulk_writer().flush()
+
+    out_query = {'from_tx_hash': {'$in': out_txs}, 'from_chain_id': chain_id}
+    in_query = {'to_tx_hash': {'$in': in_txs}, 'to_chain_id': chain_id}
+    kappas = collection.distinct('kappa', {'$or': [out_query, in_query]})
+
+    if not kappas:
+        return 0
+
+    if out_txs:
+        collection.update_many(out_query,
+                               {'$unset': {f: '' for f in OUT_FIELDS}})
+    if in_txs:
+        collection.update_many(in_query, {
+            '$unset': {f: '' for f in IN_FIELDS},
+            '$set': {'pending': True},
+        })
+
+    return collection.delete_many({
+        'kappa': {'$in': kappas},
+        'from_tx_hash': {'$exists': False},
+        'to_tx_hash': {'$exists': False},
+    }).deleted_count
@@ -0,0 +1,133 @@
+from typing import Any, Callable, Dict, FrozenSet, List, Tuple, Union
+
+from eth_utils import to_checksum_address
+from web3.types import LogReceipt
+from hexbytes import HexBytes
+from web3 import Web3
+
+from indexer.data import BRIDGE_ABI, TOPIC_TO_EVENT
+
+Word = Union[bytes, memoryview]
+
+# Bridge inputs only ever use these static types, each fits a single word.
+_converters: Dict[str, Callable[[Word], Any]] = {
+    'address': lambda w: to_checksum_address(bytes(w[12:])),
+    'bool': lambda w: w[31] != 0,
+    'bytes32': bytes,
+    'uint8': lambda w: int.from_bytes(w, 'big'),
+    'uint256': lambda w: int.from_bytes(w, 'big'),
+}
+
+# Functions whose input `bridge_callback` needs, see `decode_input`, by the
+# event they emit.
+_FUNCTIONS = {
+    'TokenMintAndSwap': 'mintAndSwap',
+    'TokenWithdrawAndRemove': 'withdrawAndRemove',
+}
+
+
+def _signature(abi: Dict[str, Any]) -> str:
+    return f'{abi["name"]}({",".join(i["type"] for i in abi["inputs"])})'
+
+
+class EventDecoder:
+    """
+    Decodes one bridge event straight from a log's `topics` and `data`,
+    yielding the same args as `contract.events[name]().processLog(log)`
+    without building a contract from the full bridge ABI per log.
+    """
+    __slots__ = ('name', 'indexed', 'data')
+
+    def __init__(self, abi: Dict[str, Any]) -> None:
+        self.name: str = abi['name']
+        # (arg name, topic position, converter)
+        self.indexed: List[Tuple[str, int, Callable]] = []
+        # (arg name, word offset in `data`, converter)
+        self.data: List[Tuple[str, int, Callable]] = []
+
+        for arg in abi['inputs']:
+            if arg['indexed']:
+                self.indexed.append((arg['name'], len(self.indexed) + 1,
+                                     _converters[arg['type']]))
+            else:
+                self.data.append((arg['name'], 32 * len(self.data),
+                                  _converters[arg['type']]))
+
+    def decode(self, log: LogReceipt) -> Dict[str, Any]:
+        topics = log['topics']
+        data = log['data']
+        # `data` is a hex string on web3 v5, convert once and slice views.
+        view = memoryview(
+            bytes.fromhex(data[2:]) if isinstance(data, str) else data)
+
+        res = {name: conv(topics[i]) for name, i, conv in self.indexed}
+        for name, offset, conv in self.data:
+            res[name] = conv(view[offset:offset + 32])
+
+        return res
+
+
+class FunctionDecoder:
+    """
+    Like :class:`EventDecoder` for a transaction's input, what
+    `contract.decode_function_input` returns as its second item.
+    """
+    __slots__ = ('name', 'args')
+
+    def __init__(self, abi: Dict[str, Any]) -> None:
+        self.name: str = abi['name']
+        self.args = [(arg['name'], 4 + 32 * i, _converters[arg['type']])
+                     for i, arg in enumerate(abi['inputs'])]
+
+    def decode(self, view: memoryview) -> Dict[str, Any]:
+        return {
+            name: conv(view[offset:offset + 32])
+            for name, offset, conv in self.args
+        }
+
+
+def _build() -> Tuple[Dict[str, EventDecoder], Dict[bytes, FunctionDecoder]]:
+    events = {x['name']: x for x in BRIDGE_ABI if x['type'] == 'event'}
+    functions = {
+        x['name']: x
+        for x in BRIDGE_ABI
+        if x['type'] == 'function' and x['name'] in _FUNCTIONS.values()
+    }
+
+    event_decoders: Dict[str, EventDecoder] = {}
+    for topic, name in TOPIC_TO_EVENT.items():
+        abi = events[name]
+        assert Web3.keccak(text=_signature(abi)).hex() == topic, \
+            f'{topic} is not the topic of {_signature(abi)}'
+
+        event_decoders[topic] = EventDecoder(abi)
+
+    function_decoders = {
+        bytes(Web3.keccak(text=_signature(abi))[:4]): FunctionDecoder(abi)
+        for abi in functions.values()
+    }
+
+    return event_decoders, function_decoders
+
+
+#: Keyed by topic hex string, like `TOPICS`.
+EVENT_DECODERS, FUNCTION_DECODERS = _build()
+
+#: Topics of the events that also need the transaction's input decoded, the
+#: only ones the transaction itself has to be fetched for.
+INPUT_TOPICS: FrozenSet[str] = frozenset(
+    topic for topic, event in TOPIC_TO_EVENT.items() if event in _FUNCTIONS)
+
+
+def decode_log(topic: str, log: LogReceipt) -> Dict[str, Any]:
+    return EVENT_DECODERS[topic].decode(log)
+
+
+def decode_input(tx_input: Union[str, bytes]) -> Dict[str, Any]:
+    view = memoryview(
+        HexBytes(tx_input) if isinstance(tx_input, str) else tx_input)
+
+    if (decoder := FUNCTION_DECODERS.get(bytes(view[:4]))) is None:
+        raise ValueError(f'no decoder for selector {bytes(view[:4]).hex()}')
+
+    return decoder.decode(view)
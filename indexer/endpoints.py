@@ -0,0 +1,755 @@
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Set, \
+    Tuple, Union
+from email.utils import parsedate_to_datetime
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+import json
+import re
+import time
+import os
+
+from web3.providers.rpc import HTTPProvider
+from web3.types import RPCEndpoint, RPCResponse
+from gevent.lock import BoundedSemaphore
+from gevent import Greenlet
+import requests
+import gevent
+
+# An endpoint failing this many requests in a row is ejected, for
+# `RPC_EJECT_SECONDS` at first and twice as long every time it fails again
+# right after, up to `RPC_MAX_EJECT_SECONDS`.
+EJECT_AFTER = int(os.getenv('RPC_EJECT_AFTER', 3))
+EJECT_SECONDS = float(os.getenv('RPC_EJECT_SECONDS', 5))
+MAX_EJECT_SECONDS = float(os.getenv('RPC_MAX_EJECT_SECONDS', 300))
+# Seconds between probes of every endpoint's head and latency.
+PROBE_SECONDS = float(os.getenv('RPC_PROBE_SECONDS', 30))
+# Endpoints this many blocks behind the best probed head are skipped.
+MAX_LAG = int(os.getenv('RPC_MAX_LAG', 50))
+# Same as web3's `make_post_request`.
+TIMEOUT = 10
+# Cool-down after a 429 without a usable `Retry-After`, and the lowest
+# rate (requests/s) repeated 429s can bring an endpoint down to.
+THROTTLE_SECONDS = float(os.getenv('RPC_THROTTLE_SECONDS', 1))
+MIN_RATE = float(os.getenv('RPC_MIN_RATE', 0.5))
+# Hedging: a read still unanswered after the `RPC_HEDGE_PERCENTILE`th
+# percentile of its method's recent latencies (at least
+# `RPC_HEDGE_MIN_DELAY` seconds) is sent to a second endpoint as well. Hedges
+# are capped at `RPC_HEDGE_BUDGET` of all requests.
+HEDGE = os.getenv('RPC_HEDGE', 'false').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.getenv('RPC_HEDGE_PERCENTILE', 95))
+HEDGE_BUDGET = float(os.getenv('RPC_HEDGE_BUDGET', 0.05))
+HEDGE_MIN_DELAY = float(os.getenv('RPC_HEDGE_MIN_DELAY', 0.05))
+# Only these are ever sent twice, whichever answers first without an error
+# is as good. `eth_getLogs` only with a block number as `toBlock`, both
+# endpoints having reached it (see `required_block`).
+HEDGE_METHODS = frozenset({
+    'eth_blockNumber',
+    'eth_chainId',
+    'eth_call',
+    'eth_getBlockByNumber',
+    'eth_getBlockByHash',
+    'eth_getBlockReceipts',
+    'eth_getLogs',
+    'eth_getTransactionByHash',
+    'eth_getTransactionReceipt',
+})
+# Methods not every node has, an endpoint answering one with "method not
+# found" is not sent it again.
+OPTIONAL_METHODS = frozenset({'eth_getBlockReceipts'})
+_METHOD_NOT_FOUND = re.compile(
+    r'the method \S+ does not exist/is not available')
+# Weight of the latest request in the latency and failure averages.
+_ALPHA = 0.2
+
+Call = Tuple[str, Any]
+
+
+class NoEndpoint(Exception):
+    pass
+
+
+def _block_number(block: Union[int, str, None]) -> Optional[int]:
+    if isinstance(block, int):
+        return block
+
+    # Tags ('latest' and co) are whatever the node has.
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+
+    return None
+
+
+def required_block(method: str, params: Any) -> Optional[int]:
+    """
+    The block an endpoint's head must have reached to answer `method`
+    completely: a node behind it returns empty or truncated results rather
+    than an error. None if any endpoint will do.
+    """
+    if not params:
+        return None
+
+    if method == 'eth_getLogs':
+        return _block_number(params[0].get('toBlock'))
+    if method in ('eth_getBlockByNumber', 'eth_getBlockReceipts'):
+        return _block_number(params[0])
+    if method == 'eth_call' and len(params) > 1:
+        return _block_number(params[1])
+
+    return None
+
+
+def hedge_key(calls: List[Call]) -> Optional[str]:
+    """
+    What latencies of `calls` are recorded under and their hedging delay is
+    derived from: the method, for batches the methods and the batch size
+    rounded up to a power of 2. None if they are not to be hedged.
+    """
+    methods = sorted({method for method, _ in calls})
+
+    if not calls or not all(method in HEDGE_METHODS for method in methods):
+        return None
+    if any(method == 'eth_getLogs' and required_block(method, params) is None
+           for method, params in calls):
+        return None
+    if len(calls) == 1:
+        return methods[0]
+
+    return f'{"+".join(methods)}x{1 << (len(calls) - 1).bit_length()}'
+
+
+def _has_error(raw: bytes) -> bool:
+    """Whether a JSON-RPC response, or any response of a batch, is an error."""
+    try:
+        resp = json.loads(raw)
+    except ValueError:
+        return True
+
+    return any(not isinstance(r, dict) or 'error' in r
+               for r in (resp if isinstance(resp, list) else [resp]))
+
+
+def method_not_found(error: Any) -> bool:
+    """
+    Whether a JSON-RPC `error` says the node lacks the method: the standard
+    code, or geth's wording for nodes answering with another code.
+    """
+    if not isinstance(error, dict):
+        return False
+
+    return error.get('code') == -32601 \
+        or bool(_METHOD_NOT_FOUND.fullmatch(str(error.get('message', ''))))
+
+
+class Throttled(Exception):
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f'{name} throttled us for {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+def retry_after(resp: requests.Response) -> float:
+    """Seconds to back off per a 429's `Retry-After`, delay or date."""
+    value = resp.headers.get('Retry-After')
+
+    if value is None:
+        return THROTTLE_SECONDS
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return THROTTLE_SECONDS
+
+
+class TokenBucket:
+    """
+    `rate` requests per second with bursts of up to a second's worth, or
+    no limit at all while `rate` is None.
+    """
+    def __init__(self, rate: Optional[float]) -> None:
+        self.rate = rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    @property
+    def burst(self) -> float:
+        return max(self.rate or 0, 1)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+
+        if self.rate is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+
+        self.updated = now
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, self.burst)
+
+    def acquire(self, n: int = 1) -> None:
+        """
+        Block the calling greenlet until `n` requests may be sent. More than
+        a burst at once goes as soon as the bucket is full, and is paid back
+        before anything else is sent.
+        """
+        while self.rate is not None:
+            self._refill()
+            wanted = min(n, self.burst)
+
+            if self.tokens >= wanted:
+                self.tokens -= n
+                return
+
+            gevent.sleep((wanted - self.tokens) / self.rate)
+
+
+class Endpoint:
+    """
+    One RPC URL of a chain and what we know of its health: moving averages
+    of latency and failure rate, its head as of the last probe and whether
+    it is ejected.
+
+    Requests are limited to `rate` per second (unlimited if None) and to
+    `max_inflight` at once. A 429 cools the endpoint down for its
+    `Retry-After` and halves the rate, starting from the rate observed if
+    there was no limit yet; every success raises it back a little, up to
+    `rate`.
+    """
+    def __init__(self,
+                 chain: str,
+                 url: str,
+                 rate: Optional[float] = None,
+                 max_inflight: int = 32) -> None:
+        self.chain = chain
+        self.url = url
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate)
+        self.inflight = BoundedSemaphore(max_inflight)
+        self.max_inflight = max_inflight
+        self.cooldown_until = 0.0
+        self.throttles = 0
+        # When the last requests were sent, to tell the rate we got 429s at.
+        self._sent: Deque[float] = deque(maxlen=100)
+        # The URL may well embed an API key, this is what gets logged.
+        self.name = urlparse(url).netloc or url
+        self.session = requests.Session()
+        self.latency = 0.0
+        self.failure_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_for = EJECT_SECONDS
+        self.head: Optional[int] = None
+        self.error: Optional[str] = None
+        # Of `OPTIONAL_METHODS`, those it answered "method not found".
+        self.unsupported: Set[str] = set()
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.time()
+
+    @property
+    def cooling(self) -> bool:
+        return self.cooldown_until > time.time()
+
+    @property
+    def busy(self) -> bool:
+        return self.inflight.locked()
+
+    def saw_head(self, block: int) -> None:
+        """The endpoint answered `eth_blockNumber` with `block`."""
+        self.head = block if self.head is None else max(self.head, block)
+
+    def observed_rate(self) -> float:
+        if len(self._sent) < 2:
+            return MIN_RATE
+
+        return len(self._sent) / max(time.monotonic() - self._sent[0], 1)
+
+    def throttled(self, seconds: float) -> None:
+        self.throttles += 1
+        self.cooldown_until = max(self.cooldown_until, time.time() + seconds)
+        rate = max((self.bucket.rate or self.observed_rate()) / 2, MIN_RATE)
+        self.bucket.set_rate(rate)
+        print(f'[{self.chain}] {self.name} throttled us, cooling down for '
+              f'{seconds:.1f}s at {rate:.1f} requests/s')
+
+    def send(self, data: bytes, calls: int = 1, **kwargs: Any) -> bytes:
+        """
+        POST `data` within the endpoint's limits, recording the outcome.
+        A batch of `calls` requests counts as that many against the rate.
+
+        Raises:
+            Throttled: on a 429, the endpoint is cooling down.
+        """
+        with self.inflight:
+            self.bucket.acquire(calls)
+            self._sent.extend([time.monotonic()] * calls)
+            start = time.time()
+
+            try:
+                resp = self.session.post(self.url, data=data, **kwargs)
+
+                if resp.status_code == 429:
+                    self.throttled(retry_after(resp))
+                    raise Throttled(self.name,
+                                    self.cooldown_until - time.time())
+
+                resp.raise_for_status()
+            except requests.RequestException as e:
+                self.failure(e)
+                raise
+
+            self.success(time.time() - start)
+            return resp.content
+
+    def score(self) -> float:
+        """Lower is better: average latency, inflated by recent failures."""
+        return (self.latency or 0.1) * (1 + 10 * self.failure_rate)
+
+    def success(self, latency: float) -> None:
+        self.requests += 1
+        self.latency = latency if not self.latency \
+            else (1 - _ALPHA) * self.latency + _ALPHA * latency
+        self.failure_rate *= 1 - _ALPHA
+
+        if self.consecutive_failures >= EJECT_AFTER:
+            print(f'[{self.chain}] {self.name} is back')
+
+        self.consecutive_failures = 0
+        self.ejected_until = 0
+        self.eject_for = EJECT_SECONDS
+
+        # Additive increase: about one request/s more per second of success.
+        rate = self.bucket.rate
+        if rate is not None and (self.max_rate is None
+                                 or rate < self.max_rate):
+            rate += 1 / rate
+            self.bucket.set_rate(rate if self.max_rate is None else min(
+                rate, self.max_rate))
+
+    def failure(self, e: Exception) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.failure_rate = (1 - _ALPHA) * self.failure_rate + _ALPHA
+        self.consecutive_failures += 1
+        self.error = str(e).replace(self.url, self.name)
+
+        # Still failing once let back in, it goes out for longer.
+        if self.consecutive_failures >= EJECT_AFTER and not self.ejected:
+            self.ejected_until = time.time() + self.eject_for
+            print(f'[{self.chain}] {self.name} ejected for '
+                  f'{self.eject_for:.0f}s after {self.consecutive_failures} '
+                  f'failures: {self.error}')
+            self.eject_for = min(self.eject_for * 2, MAX_EJECT_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'latency_ms': round(self.latency * 1000, 1),
+            'failure_rate': round(self.failure_rate, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+            'ejected_for': max(round(self.ejected_until - time.time()), 0),
+            'rate': None if self.bucket.rate is None else round(
+                self.bucket.rate, 1),
+            'inflight': self.max_inflight - self.inflight.counter,
+            'throttles': self.throttles,
+            'cooling_for': max(round(self.cooldown_until - time.time(), 1), 0),
+            'head': self.head,
+            'error': self.error,
+            'unsupported': sorted(self.unsupported),
+        }
+
+
+class Hedging:
+    """
+    Recent latencies per method, the hedging budget and how hedges fared,
+    for one chain. Every request earns `budget` of a hedge, a hedge spends
+    a whole one.
+    """
+    def __init__(self,
+                 percentile: float = HEDGE_PERCENTILE,
+                 budget: float = HEDGE_BUDGET,
+                 min_delay: float = HEDGE_MIN_DELAY,
+                 min_samples: int = 20,
+                 max_tokens: float = 10) -> None:
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.latencies: Dict[str, Deque[float]] = \
+            defaultdict(lambda: deque(maxlen=200))
+        self.requests = 0
+        self.hedged = 0
+        # Answered by the hedge first, i.e. the hedge paid off.
+        self.wins = 0
+        # Wanted to hedge, out of budget.
+        self.skipped = 0
+
+    def record(self, method: str, latency: float) -> None:
+        self.latencies[method].append(latency)
+
+    def delay(self, method: str) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: seconds to wait before hedging a `method`
+                request, None until there are enough samples.
+        """
+        self.requests += 1
+        self.tokens = min(self.tokens + self.budget, self.max_tokens)
+        samples = self.latencies[method]
+
+        if len(samples) < self.min_samples:
+            return None
+
+        ordered = sorted(samples)
+        i = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return max(ordered[i], self.min_delay)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            self.skipped += 1
+            return False
+
+        self.tokens -= 1
+        self.hedged += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'wins': self.wins,
+            'win_rate': round(self.wins / self.hedged, 3)
+            if self.hedged else None,
+            'skipped': self.skipped,
+        }
+
+
+class EndpointPool:
+    """The endpoints of a chain, ranked for every request."""
+    def __init__(self,
+                 chain: str,
+                 urls: List[str],
+                 rate: Optional[float] = None,
+                 max_inflight: int = 32) -> None:
+        self.chain = chain
+        self.endpoints = [
+            Endpoint(chain, url, rate, max_inflight) for url in urls
+        ]
+
+    def capable(self,
+                min_block: Optional[int] = None,
+                methods: FrozenSet[str] = frozenset()) -> List[Endpoint]:
+        """
+        Endpoints not known to lack any of `methods` and, given `min_block`,
+        whose head is known to have reached it.
+        """
+        return [
+            e for e in self.endpoints
+            if not methods & e.unsupported and (min_block is None or (
+                e.head is not None and e.head >= min_block))
+        ]
+
+    def supports(self, method: str) -> bool:
+        return bool(self.capable(methods=frozenset({method})))
+
+    def ranked(self,
+               min_block: Optional[int] = None,
+               methods: FrozenSet[str] = frozenset()) -> List[Endpoint]:
+        """
+        Of the :meth:`capable` endpoints, those neither ejected, cooling
+        down nor, without `min_block`, lagging behind, best first and those
+        with a request slot free ahead of those without. Should none be
+        left, all capable ones, soonest back first. Empty only if none is
+        capable.
+        """
+        capable = self.capable(min_block, methods)
+        heads = [e.head for e in self.endpoints if e.head is not None]
+        # Past `min_block`, how far behind the others it is does not matter.
+        best = max(heads, default=None) if min_block is None else None
+        usable = [
+            e for e in capable
+            if not e.ejected and not e.cooling and (
+                best is None or e.head is None or best - e.head <= MAX_LAG)
+        ]
+
+        if not usable:
+            return sorted(capable,
+                          key=lambda e: max(e.ejected_until, e.cooldown_until))
+
+        return sorted(usable, key=lambda e: (e.busy, e.score()))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [e.stats() for e in self.endpoints]
+
+
+class PoolProvider(HTTPProvider):
+    """
+    An `HTTPProvider` over several endpoints of the same chain. Every
+    request goes to the best ranked one and fails over to the next on
+    connection errors, timeouts and HTTP errors; JSON-RPC errors are the
+    node's answer and returned as such. With more than one endpoint, all
+    of them are probed every `PROBE_SECONDS` for their head and latency,
+    which is also what brings ejected ones back.
+
+    Block and range reads only go to endpoints whose head has reached the
+    highest block they ask for (see :func:`required_block`). Heads are
+    known from `eth_blockNumber` answers and probes; if no endpoint is
+    known to be far enough, all are probed first, and :class:`NoEndpoint`
+    is raised if none is. A "method not found" to one of `OPTIONAL_METHODS`
+    fails over too, that endpoint is not sent the method again.
+
+    A 429 moves on to the next endpoint as well, without counting against
+    the endpoint's health. If every one of them is cooling down, the
+    request waits for the first to be done, at most `throttle_rounds` times.
+
+    With `hedge`, reads in `HEDGE_METHODS` that the best endpoint is slow
+    to answer are also sent to the second best, see :class:`Hedging`.
+
+    `endpoint_uri` is the first URL, what per-endpoint state elsewhere
+    (e.g. :class:`WindowController`) is keyed by.
+    """
+    def __init__(self,
+                 chain: str,
+                 urls: List[str],
+                 rate: Optional[float] = None,
+                 max_inflight: int = 32,
+                 request_kwargs: Optional[Any] = None,
+                 throttle_rounds: int = 3,
+                 hedge: bool = HEDGE) -> None:
+        super().__init__(urls[0] if urls else None, request_kwargs)
+        self.pool = EndpointPool(chain, urls or [self.endpoint_uri], rate,
+                                 max_inflight)
+        self.throttle_rounds = throttle_rounds
+        self.hedging: Optional[Hedging] = Hedging() if hedge else None
+        self._prober: Optional[Greenlet] = None
+
+    def __str__(self) -> str:
+        return f'RPC pool {", ".join(e.name for e in self.pool.endpoints)}'
+
+    def _post(self, endpoint: Endpoint, data: bytes, calls: int = 1) -> bytes:
+        kwargs = dict(self.get_request_kwargs())
+        kwargs.setdefault('timeout', TIMEOUT)
+        return endpoint.send(data, calls, **kwargs)
+
+    def _hedged(self, data: bytes, calls: int, ranked: List[Endpoint],
+                delay: float) -> Optional[Tuple[bytes, Endpoint]]:
+        """
+        Send `data` to the best of `ranked` and, if it has not answered
+        within `delay` seconds, to the second best too. A response with a
+        JSON-RPC error, in any entry of a batch, only counts if the other
+        has none either.
+
+        Returns:
+            Optional[Tuple[bytes, Endpoint]]: the first successful response
+                and who sent it, None if both failed (or the only one did).
+        """
+        assert self.hedging is not None
+        ranked = [e for e in ranked if not e.cooling]
+        if not ranked:
+            return None
+
+        jobs = [gevent.spawn(self._post, ranked[0], data, calls)]
+        jobs[0].join(delay)
+
+        if not jobs[0].ready() and len(ranked) > 1 and self.hedging.spend():
+            jobs.append(gevent.spawn(self._post, ranked[1], data, calls))
+
+        try:
+            while True:
+                answered = [(job, endpoint)
+                            for job, endpoint in zip(jobs, ranked)
+                            if job.successful()]
+
+                for job, endpoint in answered:
+                    if not _has_error(job.value):
+                        if job is not jobs[0]:
+                            self.hedging.wins += 1
+                        return job.value, endpoint
+
+                if not (pending := [job for job in jobs if not job.ready()]):
+                    # Errors all round, as good as any.
+                    return (answered[0][0].value,
+                            answered[0][1]) if answered else None
+
+                gevent.wait(pending, count=1)
+        finally:
+            # The loser's connection is dropped, its slot freed.
+            gevent.killall(jobs, block=False)
+
+    def _sync(self, min_block: int, methods: FrozenSet[str]) -> None:
+        """Probe every endpoint if none is known to be at `min_block`."""
+        if not self.pool.capable(min_block, methods):
+            gevent.joinall([
+                gevent.spawn(self.probe, e)
+                for e in self.pool.capable(methods=methods)
+            ])
+
+    def post(self, data: bytes, calls: Optional[List[Call]] = None) -> bytes:
+        """
+        POST a JSON-RPC payload, single or batched.
+
+        Args:
+            data (bytes): the encoded payload.
+            calls (Optional[List[Call]]): the `(method, params)` it holds,
+                what it is routed and hedged by.
+
+        Returns:
+            bytes: the raw response of the first endpoint to answer.
+        """
+        return self._send(data, calls or [])[0]
+
+    def _send(self, data: bytes, calls: List[Call]) -> Tuple[bytes, Endpoint]:
+        if self._prober is None and len(self.pool.endpoints) > 1:
+            self._prober = gevent.spawn(self.probe_forever)
+
+        methods = frozenset(method for method, _ in calls)
+        min_block = max((b for b in (required_block(method, params)
+                                     for method, params in calls)
+                         if b is not None),
+                        default=None)
+
+        if min_block is not None:
+            self._sync(min_block, methods)
+
+        if not (ranked := self.pool.ranked(min_block, methods)):
+            raise NoEndpoint(f'no endpoint of {self.pool.chain} has reached '
+                             f'block {min_block} for {", ".join(methods)}')
+
+        # A payload of unknown calls counts as one.
+        n = max(len(calls), 1)
+        hedge = hedge_key(calls)
+        if self.hedging is None or hedge is None:
+            return self._failover(data, n, ranked, methods)
+
+        start = time.time()
+        delay = self.hedging.delay(hedge)
+
+        res = None
+        if delay is not None and len(ranked) > 1:
+            res = self._hedged(data, n, ranked, delay)
+
+        # Not hedged, or neither answered: the usual failover.
+        if res is None or self._lacks(res[1], res[0], data, methods):
+            res = self._failover(data, n, ranked, methods)
+
+        self.hedging.record(hedge, time.time() - start)
+        return res
+
+    def _lacks(self, endpoint: Endpoint, raw: bytes, data: bytes,
+               methods: FrozenSet[str]) -> bool:
+        """
+        Whether `endpoint` answered "method not found" to a call of `data` to
+        one of the `OPTIONAL_METHODS`, which it is then known to lack. Errors
+        to the other calls of a batch say nothing of those.
+        """
+        if not methods & OPTIONAL_METHODS:
+            return False
+
+        try:
+            req, resp = json.loads(data), json.loads(raw)
+        except ValueError:
+            return False
+
+        optional = {
+            r['id']: r['method']
+            for r in (req if isinstance(req, list) else [req])
+            if isinstance(r, dict) and r.get('method') in OPTIONAL_METHODS
+        }
+        lacked = {
+            optional[r['id']]
+            for r in (resp if isinstance(resp, list) else [resp])
+            if isinstance(r, dict) and r.get('id') in optional
+            and method_not_found(r.get('error'))
+        }
+        if not lacked:
+            return False
+
+        endpoint.unsupported |= lacked
+        print(f'[{self.pool.chain}] {endpoint.name} lacks '
+              f'{", ".join(sorted(lacked))}')
+        return True
+
+    def _failover(self, data: bytes, calls: int, ranked: List[Endpoint],
+                  methods: FrozenSet[str]) -> Tuple[bytes, Endpoint]:
+        error: Exception = Throttled(str(self), 0)
+        # The last "method not found", should nobody have the method.
+        lacking: Optional[Tuple[bytes, Endpoint]] = None
+
+        for _ in range(self.throttle_rounds):
+            # Only cooling down if all of them are, wait for the first.
+            gevent.sleep(max(ranked[0].cooldown_until - time.time(), 0))
+
+            for endpoint in ranked:
+                # Possibly throttled since ranked, by a concurrent request.
+                if endpoint.cooling or endpoint.unsupported & methods:
+                    continue
+
+                try:
+                    raw = self._post(endpoint, data, calls)
+                except (requests.RequestException, Throttled) as e:
+                    error = e
+                    continue
+
+                if not self._lacks(endpoint, raw, data, methods):
+                    return raw, endpoint
+
+                lacking = raw, endpoint
+
+            if lacking is not None or not isinstance(error, Throttled):
+                break
+
+        if lacking is not None:
+            return lacking
+
+        raise error
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        raw, endpoint = self._send(self.encode_rpc_request(method, params),
+                                   [(method, params)])
+        response = self.decode_rpc_response(raw)
+
+        # The cheapest way to know how far an endpoint is, by far the most
+        # frequent way too.
+        if method == 'eth_blockNumber' and 'result' in response:
+            endpoint.saw_head(int(response['result'], 16))
+
+        return response
+
+    def probe(self, endpoint: Endpoint) -> None:
+        data = json.dumps({
+            'jsonrpc': '2.0',
+            'id': 1,
+            'method': 'eth_blockNumber',
+            'params': [],
+        }).encode()
+        # Not worth a request slot or a token before it is allowed back.
+        if endpoint.cooling:
+            return
+
+        try:
+            raw = self._post(endpoint, data)
+        except (requests.RequestException, Throttled):
+            return
+
+        try:
+            endpoint.head = int(json.loads(raw)['result'], 16)
+        except (ValueError, KeyError, TypeError) as e:
+            endpoint.failure(e)
+
+    def probe_forever(self, interval: float = PROBE_SECONDS) -> None:
+        while True:
+            gevent.joinall(
+                [gevent.spawn(self.probe, e) for e in self.pool.endpoints])
+            gevent.sleep(interval)
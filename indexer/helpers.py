@@ -124,42 +124,13 @@ def dispatch_get_logs(
     for chain in SYN_DATA:
         address = SYN_DATA[chain][address_key]
 
-        if chain in [
-            'harmony',
-            'ethereum',
-            'moonriver',
-            'moonbeam',
-        ]:
-            jobs.append(
-                gevent.spawn(get_logs,
-                             chain,
-                             cb,
-                             address,
-                             max_blocks=1024,
-                             key_namespace=key_namespace))
-        elif chain == 'cronos':
-            jobs.append(
-                gevent.spawn(get_logs,
-                             chain,
-                             cb,
-                             address,
-                             max_blocks=2000,
-                             key_namespace=key_namespace))
-        elif chain in ['boba', 'bsc']:
-            jobs.append(
-                gevent.spawn(get_logs,
-                             chain,
-                             cb,
-                             address,
-                             max_blocks=512,
-                             key_namespace=key_namespace))
-        else:
-            jobs.append(
-                gevent.spawn(get_logs,
-                             chain,
-                             cb,
-                             address,
-                             key_namespace=key_namespace))
+        # Window sizes are learned per chain, see `WindowController`.
+        jobs.append(
+            gevent.spawn(get_logs,
+                         chain,
+                         cb,
+                         address,
+                         key_namespace=key_namespace))
 
     if join_all:
         gevent.joinall(jobs)
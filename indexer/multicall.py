@@ -0,0 +1,127 @@
+from typing import Any, Dict, List, NamedTuple, Sequence
+import os
+
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3.contract import ContractFunction
+from web3.types import BlockIdentifier
+from hexbytes import HexBytes
+from web3 import Web3
+
+# Same address on every chain it is deployed to, see
+# https://github.com/mds1/multicall#multicall3-contract-addresses
+MULTICALL3 = Web3.toChecksumAddress(
+    os.getenv('MULTICALL3', '0xcA11bde05977b3631167028862bE2a173976CA11'))
+MULTICALL_SIZE = int(os.getenv('MULTICALL_SIZE', 100))
+
+_AGGREGATE3 = Web3.keccak(text='aggregate3((address,bool,bytes)[])')[:4]
+# Whether `MULTICALL3` has code on a chain, checked once per chain.
+_has_multicall: Dict[str, bool] = {}
+
+
+class Result(NamedTuple):
+    success: bool
+    value: Any
+
+
+def _decode(w3: Web3, fn: ContractFunction, data: bytes) -> Result:
+    """
+    Decode `data` the way :meth:`ContractFunction.call` does, empty return
+    data (not a contract, out of range...) is a failure.
+    """
+    if not data:
+        return Result(False, None)
+
+    output_types = get_abi_output_types(fn.abi)
+
+    try:
+        ret = w3.codec.decode_abi(output_types, data)
+    except Exception:
+        return Result(False, None)
+
+    ret = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, ret)
+    return Result(True, ret[0] if len(ret) == 1 else ret)
+
+
+def _multicall(w3: Web3, calls: Sequence[ContractFunction],
+               allow_failure: bool,
+               block_identifier: BlockIdentifier) -> List[Result]:
+    data = w3.codec.encode_abi(['(address,bool,bytes)[]'], [[
+        (fn.address, allow_failure, HexBytes(fn._encode_transaction_data()))
+        for fn in calls
+    ]])
+    ret = w3.eth.call({
+        'to': MULTICALL3,
+        'data': HexBytes(_AGGREGATE3 + data),
+    }, block_identifier)
+
+    return [
+        _decode(w3, fn, data) if success else Result(False, None)
+        for fn, (success, data) in zip(
+            calls,
+            w3.codec.decode_abi(['(bool,bytes)[]'], ret)[0])
+    ]
+
+
+def _batch(w3: Web3, calls: Sequence[ContractFunction],
+           block_identifier: BlockIdentifier) -> List[Result]:
+    from indexer.batch import batch_request
+
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+
+    ret = batch_request(w3, [('eth_call', [{
+        'to': fn.address,
+        'data': fn._encode_transaction_data()
+    }, block_identifier]) for fn in calls])
+
+    # A revert comes back as an error, which `batch_request` maps to None.
+    return [
+        Result(False, None) if data is None else _decode(
+            w3, fn, HexBytes(data)) for fn, data in zip(calls, ret)
+    ]
+
+
+def aggregate(chain: str,
+              calls: Sequence[ContractFunction],
+              allow_failure: bool = True,
+              block_identifier: BlockIdentifier = 'latest') -> List[Result]:
+    """
+    Run many contract reads in as few `eth_call`s as possible: packed into
+    Multicall3's `aggregate3` where it is deployed, as a JSON-RPC batch of
+    plain `eth_call`s otherwise.
+
+    Args:
+        chain (str): the EVM chain
+        calls (Sequence[ContractFunction]): bound calls, e.g.
+            `contract.functions.getToken(0)`.
+        allow_failure (bool, optional): if False, any failed call raises
+            rather than being returned as an unsuccessful :class:`Result`.
+        block_identifier (BlockIdentifier, optional): block to read at.
+
+    Returns:
+        List[Result]: decoded like :meth:`ContractFunction.call` would, in
+            the same order as `calls`.
+    """
+    from indexer.data import SYN_DATA
+
+    w3: Web3 = SYN_DATA[chain]['w3']
+
+    if chain not in _has_multicall:
+        _has_multicall[chain] = len(w3.eth.get_code(MULTICALL3)) > 0
+
+    res: List[Result] = []
+
+    for i in range(0, len(calls), MULTICALL_SIZE):
+        chunk = calls[i:i + MULTICALL_SIZE]
+
+        if _has_multicall[chain]:
+            res += _multicall(w3, chunk, allow_failure, block_identifier)
+        else:
+            res += _batch(w3, chunk, block_identifier)
+
+    if not allow_failure and not all(r.success for r in res):
+        failed = [fn.fn_name for fn, r in zip(calls, res) if not r.success]
+        raise RuntimeError(f'{len(failed)} calls failed on {chain}: {failed}')
+
+    return res
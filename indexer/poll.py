@@ -1,12 +1,27 @@
-from typing import List, Callable, TypeVar, cast
+from typing import Deque, Dict, List, Callable, NamedTuple, Optional, TypeVar
+from collections import deque
+import time
 
 from web3.types import LogReceipt
+from gevent.event import Event
+from hexbytes import HexBytes
 from gevent import Greenlet
 from web3 import Web3
 import gevent
 
-from indexer.data import TOPICS, SYN_DATA
+from indexer.data import TOPICS, SYN_DATA, CHAINS_REVERSED, CONFIRMATIONS, \
+    BLOCK_TIMES, REORG_DEPTH, FOLLOW_DISTANCE, Direction, connect
+from indexer.checkpoint import CheckpointStore, Cursor, SeenLogs, \
+    MAX_LOG_INDEX
 from indexer.helpers import retry
+from indexer.db import MongoManager, rollback
+from indexer.rpc import _start_blocks, get_logs
+from indexer.segments import SEGMENT_CONCURRENCY, SEGMENT_SIZE, \
+    SegmentCoordinator, backfill_chain
+from indexer.batch import Enrichment, BLOCK_CACHES, batch_request, \
+    enrich_logs, to_header
+from indexer.window import WindowController, window_endpoint
+from indexer.ws import Subscription
 
 # NOTE: :type:`EventData` is not really :type:`LogReceipt`,
 # but close enough to assume its type.
@@ -14,40 +29,353 @@ CB = Callable[[str, str, LogReceipt], None]
 T = TypeVar('T')
 
 
-def log_loop(filter, chain: str, address: str, poll: int, cb: CB):
+class Block(NamedTuple):
+    number: int
+    hash: HexBytes
+    # Transactions whose logs in this block were processed, by direction.
+    out_txs: List[str]
+    in_txs: List[str]
+
+
+class HeadFollower:
+    """
+    Follows a chain's head and processes the bridge's logs once they are
+    `confirmations` blocks deep, from and advancing the same checkpoint as
+    `get_logs`. Hashes of the blocks processed within the last `REORG_DEPTH`
+    blocks are kept. Every tick the newest one is checked against the chain,
+    and only if it changed all of them; any that got reorged out anyway have
+    what their logs wrote rolled back, the checkpoint is rewound and they
+    are processed again from the fork.
+    """
+    def __init__(self,
+                 chain: str,
+                 address: str,
+                 cb: CB,
+                 confirmations: Optional[int] = None,
+                 block_time: Optional[float] = None,
+                 key_namespace: str = 'logs') -> None:
+        self.chain = chain
+        self.address = address
+        self.cb = cb
+        self.confirmations = CONFIRMATIONS[chain] \
+            if confirmations is None else confirmations
+        self.block_time = block_time or BLOCK_TIMES[chain]
+        self.w3: Web3 = connect(chain)
+        # Set to tick before the block time is up, e.g. on a new head.
+        self.wakeup = Event()
+        self.blocks: Deque[Block] = deque()
+        self.checkpoint = CheckpointStore(chain, address, key_namespace)
+        self.seen = SeenLogs(chain, address, key_namespace)
+        # Logs at or before this one were processed already. The rest of
+        # its block is not necessarily, so that is where we start.
+        self.resume = self.checkpoint.load()
+        self.next_block: Optional[int] = \
+            None if self.resume is None else self.resume.block
+        # Logs that exhausted their retries, oldest first. They are tried
+        # again every tick, and the checkpoint does not move past the block
+        # of the oldest one so a restart picks them up too.
+        self.failed: List[LogReceipt] = []
+        self.window = WindowController(chain,
+                                       window_endpoint(self.w3.provider),
+                                       None, 'live')
+
+    @property
+    def stalled(self) -> bool:
+        return bool(self.failed)
+
+    def advance(self, block: int) -> None:
+        """Move the checkpoint up to `block`, short of any failed log."""
+        if self.failed:
+            block = min(block, self.failed[0]['blockNumber'] - 1)
+
+        self.checkpoint.save(Cursor(block, MAX_LOG_INDEX, MAX_LOG_INDEX))
+        self.seen.trim(block)
+
+    def check_reorg(self) -> None:
+        if not self.blocks:
+            return
+
+        # A block's hash commits to all of its ancestors': if the newest one
+        # is still there, so is everything before it.
+        newest = self.blocks[-1]
+        if self.w3.eth.get_block(newest.number)['hash'] == newest.hash:
+            return
+
+        ret = batch_request(self.w3, [('eth_getBlockByNumber',
+                                       [hex(b.number), False])
+                                      for b in self.blocks])
+
+        for i, (block, raw) in enumerate(zip(self.blocks, ret)):
+            # Can't tell, the next tick checks again.
+            if raw is None:
+                return
+
+            if HexBytes(raw['hash']) != block.hash:
+                break
+        else:
+            return
+
+        orphaned = [self.blocks.pop() for _ in range(len(self.blocks) - i)]
+        out_txs = [tx for b in orphaned for tx in b.out_txs]
+        in_txs = [tx for b in orphaned for tx in b.in_txs]
+
+        if self.blocks:
+            self.next_block = self.blocks[-1].number + 1
+        else:
+            # Forked before anything we track, redo what we know of at least.
+            self.next_block = orphaned[-1].number
+            print(f'[{self.chain}] reorg reaches past block '
+                  f'{self.next_block}, the oldest one tracked')
+
+        deleted = rollback(CHAINS_REVERSED[self.chain], out_txs, in_txs)
+
+        # Everything from the fork on is to be done again, unless the
+        # checkpoint is held back further already.
+        fork = Cursor(self.next_block - 1, MAX_LOG_INDEX, MAX_LOG_INDEX)
+        current = self.checkpoint.load()
+        if current is None or current > fork:
+            self.checkpoint.rewind(fork)
+        self.seen.forget(self.next_block)
+        self.resume = None
+        # Those of the orphaned blocks are fetched again, from the new fork.
+        self.failed = [
+            log for log in self.failed if log['blockNumber'] < self.next_block
+        ]
+
+        print(f'[{self.chain}] reorg from block {self.next_block}, rolled '
+              f'back {len(out_txs)} OUT and {len(in_txs)} IN logs '
+              f'({deleted} deleted)')
+
+    def _process(self, log: LogReceipt,
+                 enrichment: Optional[Enrichment]) -> bool:
+        self.cb(self.chain,
+                self.address,
+                log,
+                save_block_index=False,
+                enrichment=enrichment)
+        return True
+
+    def process(self, start_block: int, to_block: int) -> None:
+        header = to_header(self.w3.eth.get_block(to_block))
+        BLOCK_CACHES[self.chain].put(header)
+
+        _fetch = time.time()
+        logs: List[LogReceipt] = self.w3.eth.get_logs({
+            'fromBlock': start_block,
+            'toBlock': to_block,
+            'address': self.w3.toChecksumAddress(self.address),
+            'topics': [list(TOPICS)],  # type: ignore
+        })
+        self.window.update(len(logs), time.time() - _fetch)
+        logs = sorted(logs,
+                      key=lambda k: (k['blockNumber'], k['transactionIndex'],
+                                     k['logIndex']))
+
+        if self.resume is not None:
+            resume = self.resume
+            logs = [log for log in logs if Cursor.from_log(log) > resume]
+        logs = self.seen.unseen(logs)
+
+        enriched: Dict[HexBytes, Enrichment] = {}
+        if logs:
+            try:
+                enriched = enrich_logs(self.chain, logs)
+            except Exception as e:
+                print(f'[{self.chain}] batched enrichment failed, '
+                      f'falling back: {e}')
+
+        blocks: Dict[int, Block] = {}
+        done: List[LogReceipt] = []
+
+        for log in logs:
+            if not retry(self._process, log,
+                         enriched.get(log['transactionHash'])):
+                self.failed.append(log)
+                held = self.failed[0]['blockNumber'] - 1
+                print(f'[{self.chain}] failed to process '
+                      f'{log["transactionHash"].hex()}, retrying every tick, '
+                      f'checkpoint held at block {held}')
+            else:
+                done.append(log)
+
+            block = blocks.setdefault(
+                log['blockNumber'],
+                Block(log['blockNumber'], log['blockHash'], [], []))
+            txs = block.out_txs if TOPICS[log['topics'][0].hex()] \
+                == Direction.OUT else block.in_txs
+            txs.append(log['transactionHash'].hex())
+
+        MongoManager.get_bulk_writer().flush()
+        self.seen.add(done)
+        self.resume = None
+        self.advance(to_block)
+
+        # The last block is kept even without logs, so a reorg of blocks we
+        # found empty is noticed as well.
+        blocks.setdefault(header.number,
+                          Block(header.number, header.hash, [], []))
+        self.blocks.extend(blocks.values())
+
+        while self.blocks and self.blocks[0].number <= to_block - REORG_DEPTH:
+            self.blocks.popleft()
+
+    def retry_failed(self) -> None:
+        if not self.failed:
+            return
+
+        failed, self.failed = self.failed, []
+        done: List[LogReceipt] = []
+
+        for log in failed:
+            # Every tick is another round of attempts, one each is enough.
+            if retry(self._process, log, None, attempts=1):
+                done.append(log)
+            else:
+                self.failed.append(log)
+
+        MongoManager.get_bulk_writer().flush()
+        self.seen.add(done)
+
+        if self.next_block is not None and done:
+            if not self.failed:
+                print(f'[{self.chain}] failed logs processed, checkpoint '
+                      'released')
+            self.advance(self.next_block - 1)
+
+    def tick(self) -> None:
+        head = self.w3.eth.block_number
+
+        if self.next_block is None:
+            self.next_block = head + 1
+
+        self.check_reorg()
+        self.retry_failed()
+        safe = head - self.confirmations
+
+        while self.next_block <= safe:
+            to_block = min(self.next_block + self.window.size, safe)
+
+            try:
+                self.process(self.next_block, to_block)
+            except Exception as e:
+                if self.window.shrink(e):
+                    continue
+
+                raise
+
+            self.next_block = to_block + 1
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f'[{self.chain}] head follower: {e}')
+
+            self.wakeup.wait(self.block_time)
+            self.wakeup.clear()
+
+
+def wakeups(chain: str, url: str, event: Event, max_delay: int = 60) -> None:
+    """
+    Set `event` on every new head `url` pushes, so the follower does not
+    wait out its poll interval. Resubscribes whenever the socket drops.
+
+    Logs are not taken from the socket: pushed ones are unconfirmed, and
+    the follower reads the confirmed range with `eth_getLogs` regardless.
+    """
+    delay = 1
+
     while True:
         try:
-            # `event` is of type `EventData`.
-            for event in filter.get_new_entries():
-                print("New event")
-                retry(cb, chain, address, event, save_block_index=False)
+            with Subscription(url, ['newHeads']) as sub:
+                delay = 1
+
+                for _ in sub:
+                    event.set()
         except Exception as e:
-            print(f'err filter log_loop: {e}')
-        finally:
-            gevent.sleep(poll)
+            print(f'[{chain}] newHeads subscription failed, retrying in '
+                  f'{delay}s: {e}')
 
+        gevent.sleep(delay)
+        delay = min(delay * 2, max_delay)
 
-def start(cb: CB) -> None:
-    jobs: List[Greenlet] = []
 
-    for chain, x in SYN_DATA.items():
-        _address = Web3.toChecksumAddress(x['bridge'])
+def catch_up(chain: str,
+             address: str,
+             cb: CB,
+             distance: int = FOLLOW_DISTANCE) -> None:
+    """
+    Run `get_logs` from the checkpoint up to the confirmed head, again and
+    again, until the checkpoint is within `distance` blocks of it. With
+    `SEGMENT_CONCURRENCY` above 1, anything more than a segment behind is
+    backfilled as concurrent segments instead.
+    """
+    w3 = connect(chain)
+    checkpoint = CheckpointStore(chain, address)
+    segments = SegmentCoordinator(chain, address)
 
-        filter = cast(Web3, x['w3']).eth.filter({
-            'address': _address,
-            'fromBlock': 'latest',
-            'topics': [list(TOPICS)],
-        })
+    while True:
+        cursor = checkpoint.load()
+        safe = w3.eth.block_number - CONFIRMATIONS[chain]
+
+        # Left by a crash, whatever the distance those must finish first.
+        unfinished = SEGMENT_CONCURRENCY > 1 and segments.unfinished()
+
+        if not unfinished and cursor is not None \
+                and safe - cursor.block <= distance:
+            return
+
+        if unfinished or SEGMENT_CONCURRENCY > 1 and (
+                cursor is None or safe - cursor.block > SEGMENT_SIZE):
+            start_block = _start_blocks[chain] if cursor is None \
+                else max(cursor.block + 1, _start_blocks[chain])
+
+            try:
+                backfill_chain(chain, address, cb, start_block, safe)
+            except Exception as e:
+                print(f'[{chain}] segmented backfill failed: {e}')
+                gevent.sleep(10)
+            continue
+
+        try:
+            get_logs(chain, cb, address, till_block=safe)
+        except Exception as e:
+            print(f'[{chain}] catching up failed: {e}')
+            gevent.sleep(10)
+            continue
+
+        # Stuck on a log that keeps failing, the follower starts from the
+        # held checkpoint and retries it every tick.
+        if checkpoint.load() == cursor:
+            return
+
+
+def follow(chain: str, address: str, cb: CB) -> None:
+    """
+    The one ingestion loop of a chain: catch up in large `get_logs` windows,
+    then follow the head from the same checkpoint.
+    """
+    catch_up(chain, address, cb)
+    print(f'[{chain}] caught up, following the head')
+
+    follower = HeadFollower(chain, address, cb)
+
+    if (url := SYN_DATA[chain].get('ws')):
+        gevent.spawn(wakeups, chain, url, follower.wakeup)
+
+    follower.run()
+
+
+def start(cb: CB, chains: Optional[List[str]] = None) -> None:
+    jobs: List[Greenlet] = []
 
+    for chain in chains or SYN_DATA:
+        # Each chain connects on its own, a dead endpoint only stalls its own
+        # greenlet. Chains with a `ws` endpoint tick on every new head,
+        # the others every `BLOCK_TIMES[chain]` seconds.
         jobs.append(
-            gevent.spawn(
-                log_loop,
-                filter,
-                chain,
-                _address,
-                poll=2,
-                cb=cb,
-            ))
+            gevent.spawn(follow, chain, SYN_DATA[chain]['bridge'], cb=cb))
 
     # This will never sanely finish.
     gevent.joinall(jobs)
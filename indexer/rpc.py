@@ -1,20 +1,30 @@
-from typing import Callable, Dict, Optional, Tuple, Union, cast, List, overload
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, \
+    Union, cast, List, overload
 from collections import namedtuple
 import time
 from indexer.db import MongoManager
-from pymongo.database import Database
+from web3.exceptions import TransactionNotFound
 from web3.types import FilterParams, LogReceipt
 from hexbytes import HexBytes
+from gevent.queue import Queue
+from gevent.pool import Pool
 from web3 import Web3
 import gevent
 
-from indexer.data import BRIDGE_ABI, SYN_DATA, LOGS_REDIS_URL, \
+from indexer.data import SYN_DATA, \
     TOKENS_INFO, TOPICS, TOPIC_TO_EVENT, Direction, CHAINS_REVERSED, \
-    MISREPRESENTED_MAP
+    MISREPRESENTED_MAP, RPC_BATCH_SIZE, CALLBACK_CONCURRENCY, PREFETCH_DEPTH, \
+    connect
 from indexer.helpers import convert, retry, search_logs, \
     iterate_receipt_logs
 from indexer.transactions import Transaction, LostTransaction
 from indexer.contract import get_pool_data
+from indexer.decoders import decode_input, decode_log
+from indexer.window import WindowController, window_endpoint
+from indexer.checkpoint import CheckpointStore, Cursor, SeenLogs, \
+    MAX_LOG_INDEX
+from indexer.batch import Enrichment, BLOCK_CACHES, enrich_logs, \
+    get_block_header
 
 # Start blocks of the 4pool >=Nov-7th-2021.
 _start_blocks = {
@@ -36,7 +46,9 @@ _start_blocks = {
 }
 
 WETH = HexBytes('0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2')
-MAX_BLOCKS = 2048
+
+# A fetched `get_logs` window: its last block, its logs and their enrichment.
+Window = Tuple[int, List[LogReceipt], Dict[HexBytes, Enrichment]]
 
 OUT_SQL = """
 INSERT into
@@ -95,53 +107,58 @@ VALUES
 """
 
 
+# Compact views over the decoded event args, see `Events`.
+_SwapOut = namedtuple('_SwapOut', ['to', 'chain_id', 'token_idx_to'])
+_DepositOut = namedtuple('_DepositOut',
+                         ['to', 'chain_id', 'sent_token', 'sent_value'])
+_RedeemOut = namedtuple('_RedeemOut', ['to', 'chain_id', 'token'])
+_SwapIn = namedtuple('_SwapIn',
+                     ['to', 'fee', 'token_idx_to', 'swap_success', 'token'])
+_WithdrawIn = namedtuple('_WithdrawIn', ['to', 'fee', 'token', 'amount'])
+
+
 class Events(object):
     # OUT EVENTS
     @classmethod
     def TokenDepositAndSwap(cls, args):
-        x = namedtuple('x', ['to', 'chain_id', 'token_idx_to'])
-        return x(HexBytes(args['to']), args['chainId'], args['tokenIndexTo'])
+        return _SwapOut(HexBytes(args['to']), args['chainId'],
+                        args['tokenIndexTo'])
 
     TokenRedeemAndSwap = TokenDepositAndSwap
 
     @classmethod
     def TokenDeposit(cls, args):
-        x = namedtuple('x', ['to', 'chain_id', 'sent_token', 'sent_value'])
-        return x(HexBytes(args['to']), args['chainId'], args['token'],
-                 args['amount'])
+        return _DepositOut(HexBytes(args['to']), args['chainId'],
+                           args['token'], args['amount'])
 
     @classmethod
     def TokenRedeemAndRemove(cls, args):
-        x = namedtuple('x', ['to', 'chain_id', 'token_idx_to'])
-        return x(HexBytes(args['to']), args['chainId'], args['swapTokenIndex'])
+        return _SwapOut(HexBytes(args['to']), args['chainId'],
+                        args['swapTokenIndex'])
 
     @classmethod
     def TokenRedeem(cls, args):
-        x = namedtuple('x', ['to', 'chain_id', 'token'])
-        return x(HexBytes(args['to']), args['chainId'], args['token'])
+        return _RedeemOut(HexBytes(args['to']), args['chainId'],
+                          args['token'])
 
     # IN EVENTS
     @classmethod
     def TokenWithdrawAndRemove(cls, args):
-        x = namedtuple('x',
-                       ['to', 'fee', 'token_idx_to', 'swap_success', 'token'])
-        return x(HexBytes(args['to']), args['fee'], args['swapTokenIndex'],
-                 args['swapSuccess'], args['token'])
+        return _SwapIn(HexBytes(args['to']), args['fee'],
+                       args['swapTokenIndex'], args['swapSuccess'],
+                       args['token'])
 
     @classmethod
     def TokenWithdraw(cls, args):
-        x = namedtuple('x', ['to', 'fee', 'token', 'amount'])
-        return x(HexBytes(args['to']), args['fee'], args['token'],
-                 args['amount'])
+        return _WithdrawIn(HexBytes(args['to']), args['fee'], args['token'],
+                           args['amount'])
 
     TokenMint = TokenWithdraw
 
     @classmethod
     def TokenMintAndSwap(cls, args):
-        x = namedtuple('x',
-                       ['to', 'fee', 'token_idx_to', 'swap_success', 'token'])
-        return x(HexBytes(args['to']), args['fee'], args['tokenIndexTo'],
-                 args['swapSuccess'], args['token'])
+        return _SwapIn(HexBytes(args['to']), args['fee'], args['tokenIndexTo'],
+                       args['swapSuccess'], args['token'])
 
 
 def check_factory(max_value: int):
@@ -155,8 +172,8 @@ def check_factory(max_value: int):
 def bridge_callback(chain: str,
                     address: str,
                     log: LogReceipt,
-                    abi: str = BRIDGE_ABI,
-                    save_block_index: bool = True) -> None:
+                    save_block_index: bool = True,
+                    enrichment: Optional[Enrichment] = None) -> None:
     ...
 
 
@@ -165,9 +182,10 @@ def bridge_callback(
         chain: str,
         address: str,
         log: LogReceipt,
-        abi: str = BRIDGE_ABI,
         save_block_index: bool = True,
-        testing: bool = False) -> Union[Transaction, LostTransaction]:
+        testing: bool = False,
+        enrichment: Optional[Enrichment] = None
+) -> Union[Transaction, LostTransaction]:
     ...
 
 
@@ -176,24 +194,30 @@ def bridge_callback(
         chain: str,
         address: str,
         log: LogReceipt,
-        abi: str = BRIDGE_ABI,
         save_block_index: bool = True,
-        testing: bool = False
+        testing: bool = False,
+        enrichment: Optional[Enrichment] = None
 ) -> Optional[Union[Transaction, LostTransaction]]:
     w3: Web3 = SYN_DATA[chain]['w3']
-    contract = w3.eth.contract(w3.toChecksumAddress(address), abi=abi)
     tx_hash = log['transactionHash']
 
-    timestamp = w3.eth.get_block(log['blockNumber'])
-    timestamp = timestamp['timestamp']  # type: ignore
-    tx_info = w3.eth.get_transaction(tx_hash)
-    assert 'from' in tx_info  # Make mypy happy - look key 'from' exists!
+    # Whatever `get_logs` prefetched in batches, anything missing
+    # is fetched the old way.
+    tx_info, receipt = enrichment or (None, None)
+    timestamp = get_block_header(chain, log).timestamp
+
     from_chain = CHAINS_REVERSED[chain]
 
-    # The info before wrapping the asset can be found in the receipt.
-    receipt = w3.eth.wait_for_transaction_receipt(tx_hash,
-                                                  timeout=10,
-                                                  poll_latency=0.5)
+    # The info before wrapping the asset can be found in the receipt. The
+    # log is already mined so the receipt normally is too, only wait on the
+    # node catching up if it says otherwise.
+    if receipt is None:
+        try:
+            receipt = w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash,
+                                                          timeout=10,
+                                                          poll_latency=0.5)
 
     topic = cast(str, convert(log['topics'][0]))
     if topic not in TOPICS:
@@ -204,7 +228,7 @@ def bridge_callback(
     event = TOPIC_TO_EVENT[topic]
     direction = TOPICS[topic]
 
-    args = contract.events[event]().processLog(log)['args']
+    args = decode_log(topic, log)
 
     if direction == Direction.OUT:
         kappa = w3.keccak(text=tx_hash.hex())
@@ -256,38 +280,18 @@ def bridge_callback(
                 f'did not converge OUT event: {event} {tx_hash.hex()} {chain}'
                 f' args: {args}')
 
-        txn = Transaction(tx_hash, None, HexBytes(tx_info['from']),
+        txn = Transaction(tx_hash, None, HexBytes(receipt['from']),
                           data.to, sent_value, None, True, from_chain,
                           data.chain_id, timestamp, None, None,
                           sent_token_address, None, kappa)
 
-        # Store in DB
+        # Store in DB, the OUT side of the kappa. Only marked pending if
+        # the IN side has not created the document already.
         if not testing:
-            try:
-                db: Database = MongoManager.get_db_instance()
-
-                txn_with_kappa = db.transactions.find_one({'kappa': kappa.hex()})
-
-                if not txn_with_kappa:
-                    # OUT received first. Store transaction as pending normally
-                    db.transactions.insert_one(txn.serialize())
-                    print(f"Inserted OUT transaction having with {kappa.hex()} txn hash {tx_hash.hex()}")
-
-                else:
-                    # IN already was received before OUT. Set missing values and unset pending
-                    txn.pending = False
-                    db.transactions.update_one(
-                        {'kappa': kappa.hex()},
-                        {
-                            "$set": {
-                                **txn.serialize(),
-                            }
-                        }
-                    )
-                    print(f"Transaction matching complete. Updated OUT for transaction with kappa {kappa.hex()} txn hash {tx_hash.hex()}")
-
-            except Exception as e:
-                print("Error storing in DB!", e)
+            doc = txn.serialize()
+            pending = doc.pop('pending')
+            MongoManager.get_bulk_writer().upsert(doc['kappa'], doc,
+                                                  {'pending': pending})
 
         return txn
 
@@ -296,8 +300,11 @@ def bridge_callback(
         kappa = args['kappa']
 
         if event in ['TokenWithdrawAndRemove', 'TokenMintAndSwap']:
+            if tx_info is None:
+                tx_info = w3.eth.get_transaction(tx_hash)
+
             assert 'input' in tx_info  # IT EXISTS MYPY!
-            _, inp_args = contract.decode_function_input(tx_info['input'])
+            inp_args = decode_input(tx_info['input'])
             pool = get_pool_data(chain, inp_args['pool'])
 
             if event == 'TokenWithdrawAndRemove':
@@ -357,65 +364,63 @@ def bridge_callback(
                                    from_chain, timestamp, received_token,
                                    swap_success, kappa)
 
-        # Store in DB
+        # Store in DB, the IN side of the kappa completes the transaction
+        # whether or not the OUT side was seen yet.
         if not testing:
-            try:
-                db: Database = MongoManager.get_db_instance()
-                txn_with_kappa = db.transactions.find_one({'kappa': kappa.hex()})
-
-                # OUT already exists. Just set IN values and unset pending
-                if txn_with_kappa:
-                    db.transactions.update_one(
-                        {'kappa': kappa.hex()},
-                        {
-                            "$set": {
-                                **lost_txn.serialize(),
-                                "pending": False
-                            }
-                        }
-                    )
-                    print(f"Transaction matching complete. Updated IN for transaction with with kappa {kappa.hex()} txn hash {tx_hash.hex()}")
-                else:
-                    # IN txn shows up first
-                    to_insert = lost_txn.serialize()
-                    db.transactions.insert_one(to_insert)
-                    print(f"Updated IN for transaction with kappa {kappa.hex()} txn hash {tx_hash.hex()}")
-
-            except Exception as e:
-                print("Error storing in DB!", e)
+            doc = lost_txn.serialize()
+            MongoManager.get_bulk_writer().upsert(doc['kappa'], {
+                **doc,
+                'pending': False,
+            })
 
     if save_block_index:
-        LOGS_REDIS_URL.set(f'{chain}:logs:{address}:MAX_BLOCK_STORED',
-                           log['blockNumber'])
-        LOGS_REDIS_URL.set(f'{chain}:logs:{address}:TX_INDEX',
-                           log['transactionIndex'])
+        if not testing:
+            MongoManager.get_bulk_writer().flush()
+
+        CheckpointStore(chain, address).save(Cursor.from_log(log))
+
+
+def flush_writes() -> bool:
+    MongoManager.get_bulk_writer().flush()
+    return True
 
 
 def get_logs(
         chain: str,
-        callback: Callable[[str, str, LogReceipt], None],
+        callback: Callable[..., None],
         address: str,
         start_block: int = None,
         till_block: int = None,
-        max_blocks: int = MAX_BLOCKS,
+        max_blocks: Optional[int] = None,
         topics: List[str] = list(TOPICS),
         key_namespace: str = 'logs',
         start_blocks: Dict[str, int] = _start_blocks,
-) -> None:
-    w3: Web3 = SYN_DATA[chain]['w3']
+        batch_size: int = RPC_BATCH_SIZE,
+        concurrency: Optional[int] = None,
+        prefetch: int = PREFETCH_DEPTH,
+        cursor_namespace: Optional[str] = None,
+) -> bool:
+    """
+    Process `address`' logs from its checkpoint (or `start_block`) up to and
+    including `till_block`. The checkpoint and the logs seen past it are kept
+    under `cursor_namespace`, `key_namespace` by default.
+
+    Returns:
+        bool: False if a log exhausted its retries, the checkpoint is held
+            before it.
+    """
+    w3 = connect(chain)
     _chain = f'[{chain}]'
     chain_len = max(len(c) for c in SYN_DATA) + 2
-    tx_index = -1
+    checkpoint = CheckpointStore(chain, address, cursor_namespace
+                                 or key_namespace)
+    seen = SeenLogs(chain, address, cursor_namespace or key_namespace)
+    # Logs at or before this one were processed by a previous run.
+    resume: Optional[Cursor] = None
 
     if start_block is None:
-        _key_block = f'{chain}:{key_namespace}:{address}:MAX_BLOCK_STORED'
-        _key_index = f'{chain}:{key_namespace}:{address}:TX_INDEX'
-
-        if (ret := LOGS_REDIS_URL.get(_key_block)) is not None:
-            start_block = max(int(ret), start_blocks[chain])
-
-            if (ret := LOGS_REDIS_URL.get(_key_index)) is not None:
-                tx_index = int(ret)
+        if (resume := checkpoint.load()) is not None:
+            start_block = max(resume.block, start_blocks[chain])
         else:
             start_block = start_blocks[chain]
 
@@ -426,55 +431,178 @@ def get_logs(
         f'{key_namespace} | {_chain:{chain_len}} starting from {start_block} '
         f'with block height of {till_block}')
 
-    jobs: List[gevent.Greenlet] = []
     _start = time.time()
     x = 0
 
     total_events = 0
     initial_block = start_block
+    pool = Pool(concurrency or CALLBACK_CONCURRENCY[chain])
+    # Set once a log exhausted its retries, the checkpoint must not move
+    # past it so it gets picked up again on the next run.
+    stalled = False
+
+    def process(log: LogReceipt, enrichment: Optional[Enrichment]) -> bool:
+        callback(chain,
+                 address,
+                 log,
+                 save_block_index=False,
+                 enrichment=enrichment)
+        return True
+
+    # `max_blocks` is only the starting point, the window adapts to
+    # the provider's limits and to event density.
+    window = WindowController(chain, window_endpoint(w3.provider), max_blocks,
+                              key_namespace)
+
+    def windows(start_block: int) -> Iterator[Window]:
+        """Fetch and enrich the windows from `start_block` on, in order."""
+        while start_block <= till_block:
+            to_block = min(start_block + window.size, till_block)
+
+            params: FilterParams = {
+                'fromBlock': start_block,
+                'toBlock': to_block,
+                'address': w3.toChecksumAddress(address),
+                'topics': [topics],  # type: ignore
+            }
+
+            _fetch = time.time()
+            try:
+                logs: List[LogReceipt] = w3.eth.get_logs(params)
+            except Exception as e:
+                if window.shrink(e):
+                    print(f'{key_namespace} | {_chain:{chain_len}} '
+                          f'window shrunk to {window.size} blocks: {e}')
+                    continue
 
-    while start_block < till_block:
-        to_block = min(start_block + max_blocks, till_block)
-
-        params: FilterParams = {
-            'fromBlock': start_block,
-            'toBlock': to_block,
-            'address': w3.toChecksumAddress(address),
-            'topics': [topics],  # type: ignore
-        }
-
-        logs: List[LogReceipt] = w3.eth.get_logs(params)
-        # Apparently, some RPC nodes don't bother
-        # sorting events in a chronological order.
-        # Let's sort them by block (from oldest to newest)
-        # And by transaction index (within the same block,
-        # also in ascending order)
-        logs = sorted(
-            logs,
-            key=lambda k: (k['blockNumber'], k['transactionIndex']),
-        )
-
-        for log in logs:
-            # Skip transactions from the very first block
-            # that are already in the DB
-            if log['blockNumber'] == initial_block \
-                    and log['transactionIndex'] <= tx_index:
-                continue
-
-            retry(callback, chain, address, log)
-
-        start_block += max_blocks + 1
-
-        y = time.time() - _start
-        total_events += len(logs)
-
-        percent = 100 * (to_block - initial_block) \
-                  / (till_block - initial_block)
+                raise
 
-        print(f'{key_namespace} | {_chain:{chain_len}} elapsed {y:5.1f}s'
-              f' ({y - x:5.1f}s), found {total_events:5} events,'
-              f' {percent:4.1f}% done: so far at block {start_block}')
-        x = y
+            window.update(len(logs), time.time() - _fetch)
+            # Apparently, some RPC nodes don't bother
+            # sorting events in a chronological order.
+            # Let's sort them by block (from oldest to newest)
+            # And by transaction and log index (within the same block,
+            # also in ascending order)
+            logs = sorted(
+                logs,
+                key=lambda k:
+                (k['blockNumber'], k['transactionIndex'], k['logIndex']),
+            )
 
-    gevent.joinall(jobs)
-    print(f'{_chain:{chain_len}} it took {time.time() - _start:.1f}s!')
+            # Skip logs from the very first block
+            # that are already in the DB
+            if resume is not None:
+                logs = [
+                    log for log in logs
+                    if Cursor.from_log(log) > resume  # type: ignore
+                ]
+
+            # And those done past the checkpoint, e.g. by the head
+            # follower or by a run that stopped mid window.
+            logs = seen.unseen(logs)
+
+            # Block headers, transactions and receipts of the whole page
+            # in a few batched round trips, the callback falls back for
+            # anything missing.
+            enriched: Dict[HexBytes, Enrichment] = {}
+            if batch_size and logs:
+                try:
+                    enriched = enrich_logs(chain, logs, batch_size)
+                except Exception as e:
+                    print(f'{key_namespace} | {_chain:{chain_len}} '
+                          f'batched enrichment failed, falling back: {e}')
+
+            yield to_block, logs, enriched
+            start_block = to_block + 1
+
+    def fetch(queue: Queue) -> None:
+        """
+        Producer half of the pipeline: runs `windows` ahead of the
+        callbacks, at most `prefetch` of them are buffered.
+        """
+        try:
+            for item in windows(start_block):
+                queue.put(item)
+        except Exception as e:
+            # Re-raised by the consumer, same as before pipelining.
+            queue.put(e)
+        finally:
+            queue.put(StopIteration)
+
+    # Without prefetching each window is fetched once the previous one is
+    # processed.
+    queue: Optional[Queue] = None
+    fetcher: Optional[gevent.Greenlet] = None
+    items: Iterable[Union[Window, Exception]] = windows(start_block)
+    if prefetch > 0:
+        queue = Queue(prefetch)
+        fetcher = gevent.spawn(fetch, queue)
+        items = queue
+
+    try:
+        for item in items:
+            if isinstance(item, Exception):
+                raise item
+
+            to_block, logs, enriched = item
+            jobs = [
+                pool.spawn(retry, process, log,
+                           enriched.get(log['transactionHash']))
+                for log in logs
+            ]
+            pool.join()
+
+            # The window's writes must land before its checkpoint does.
+            if retry(flush_writes) is None:
+                stalled = True
+            else:
+                seen.add(log for log, job in zip(logs, jobs) if job.value)
+
+            # Only ever checkpoint the highest contiguous processed log, logs
+            # complete out of order and a crash must never skip a failed one.
+            if not stalled:
+                done = 0
+                while done < len(jobs) and jobs[done].value:
+                    done += 1
+
+                # Once per window, however many logs it had. A fully done
+                # window counts up to its last block, even if it was empty.
+                cursor: Optional[Cursor] = None
+                if done == len(jobs):
+                    cursor = Cursor(to_block, MAX_LOG_INDEX, MAX_LOG_INDEX)
+                elif done:
+                    cursor = Cursor.from_log(logs[done - 1])
+
+                if cursor is not None:
+                    checkpoint.save(cursor)
+                    seen.trim(cursor.block)
+
+                if done < len(jobs):
+                    stalled = True
+                    print(f'{key_namespace} | {_chain:{chain_len}} failed to '
+                          f'process {logs[done]["transactionHash"].hex()}, '
+                          f'checkpoint held at block '
+                          f'{logs[done]["blockNumber"]}')
+
+            y = time.time() - _start
+            total_events += len(logs)
+
+            percent = 100 * (to_block - initial_block) \
+                      / max(till_block - initial_block, 1)
+
+            print(f'{key_namespace} | {_chain:{chain_len}} elapsed {y:5.1f}s'
+                  f' ({y - x:5.1f}s), found {total_events:5} events,'
+                  f' {percent:4.1f}% done: so far at block {to_block + 1}'
+                  f' (window {window.size}, '
+                  f'{queue.qsize() if queue else 0} prefetched)')
+            x = y
+    finally:
+        # Killed mid window (e.g. a segment's lease was lost), none of its
+        # callbacks may keep writing.
+        pool.kill()
+        if fetcher is not None:
+            fetcher.kill()
+
+    print(f'{_chain:{chain_len}} it took {time.time() - _start:.1f}s! '
+          f'{BLOCK_CACHES[chain]}')
+    return not stalled
@@ -0,0 +1,441 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import socket
+import time
+import os
+
+import gevent
+
+from indexer.data import LOGS_REDIS_URL, SYN_DATA, CONFIRMATIONS, connect
+from indexer.checkpoint import CheckpointStore, Cursor, SeenLogs, \
+    MAX_LOG_INDEX
+from indexer.rpc import _start_blocks, get_logs
+
+# Blocks per leased segment and seconds a lease lasts without a heartbeat,
+# heartbeats are sent every third of it.
+SEGMENT_SIZE = int(os.getenv('SEGMENT_SIZE', 200000))
+LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', 60))
+# Segments worked at once per chain and node, 1 keeps catching up sequential.
+SEGMENT_CONCURRENCY = int(os.getenv('SEGMENT_CONCURRENCY', 1))
+
+# Splits what is not planned yet of [ARGV[1], ARGV[2]] into segments of
+# ARGV[3] blocks. Idempotent, any number of nodes may plan the same range.
+_PLAN = LOGS_REDIS_URL.register_script("""
+local start = tonumber(ARGV[1])
+local last = tonumber(ARGV[2])
+local size = tonumber(ARGV[3])
+local nxt = math.max(tonumber(redis.call('GET', KEYS[2])) or start, start)
+local n = 0
+
+while nxt <= last do
+    local e = math.min(nxt + size - 1, last)
+    redis.call('ZADD', KEYS[1], nxt, string.format('%d-%d', nxt, e))
+    nxt = e + 1
+    n = n + 1
+end
+
+redis.call('SET', KEYS[2], string.format('%d', nxt))
+return n
+""")
+
+# Puts expired leases back to pending, then leases the lowest pending
+# segment to ARGV[3] until ARGV[1] + ARGV[2] (ms).
+_CLAIM = LOGS_REDIS_URL.register_script("""
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+
+for _, seg in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], seg)
+    redis.call('HDEL', KEYS[3], seg)
+    redis.call('ZADD', KEYS[1], tonumber(string.match(seg, '^%d+')), seg)
+end
+
+local seg = redis.call('ZPOPMIN', KEYS[1])
+if #seg == 0 then
+    return {false, #expired}
+end
+
+redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), seg[1])
+redis.call('HSET', KEYS[3], seg[1], ARGV[3])
+return {seg[1], #expired}
+""")
+
+# Extends the lease of ARGV[1] to ARGV[3], if ARGV[2] still holds it.
+_HEARTBEAT = LOGS_REDIS_URL.register_script("""
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+""")
+
+# Hands ARGV[1] back to pending if ARGV[2] still holds it.
+_ABANDON = LOGS_REDIS_URL.register_script("""
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZADD', KEYS[3], tonumber(string.match(ARGV[1], '^%d+')), ARGV[1])
+return 1
+""")
+
+# Marks ARGV[1] done if ARGV[2] still holds it. Done ranges are kept as an
+# interval set: disjoint, each merged with whatever it overlaps or touches.
+_COMPLETE = LOGS_REDIS_URL.register_script("""
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+
+local s, e = string.match(ARGV[1], '^(%d+)-(%d+)$')
+s, e = tonumber(s), tonumber(e)
+
+for _, r in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', e + 1)) do
+    local rs, re = string.match(r, '^(%d+)-(%d+)$')
+    rs, re = tonumber(rs), tonumber(re)
+
+    if re >= s - 1 then
+        s, e = math.min(s, rs), math.max(e, re)
+        redis.call('ZREM', KEYS[3], r)
+    end
+end
+
+redis.call('ZADD', KEYS[3], s, string.format('%d-%d', s, e))
+return 1
+""")
+
+
+class Segment(NamedTuple):
+    start: int
+    # Inclusive.
+    end: int
+
+    def __str__(self) -> str:
+        return f'{self.start}-{self.end}'
+
+    @classmethod
+    def parse(cls, raw: str) -> 'Segment':
+        start, end = raw.split('-')
+        return cls(int(start), int(end))
+
+
+def merge(segments: List[Segment]) -> List[Segment]:
+    """Coalesce overlapping and adjacent segments into disjoint ranges."""
+    res: List[Segment] = []
+
+    for seg in sorted(segments):
+        if res and seg.start <= res[-1].end + 1:
+            res[-1] = Segment(res[-1].start, max(res[-1].end, seg.end))
+        else:
+            res.append(seg)
+
+    return res
+
+
+class SegmentCoordinator:
+    """
+    Block ranges of a chain/address split into segments, leased from redis
+    to whichever node claims them. A lease not heartbeated within its ttl is
+    handed to the next node to claim; every transition is a single script,
+    so a node that lost its lease can no longer complete or abandon it.
+    """
+    def __init__(self,
+                 chain: str,
+                 address: str,
+                 key_namespace: str = 'logs') -> None:
+        self.chain = chain
+        self.address = address
+        self.key_namespace = key_namespace
+        prefix = f'{chain}:{key_namespace}:{address}:SEGMENTS'
+        self.pending = f'{prefix}:PENDING'
+        self.leased = f'{prefix}:LEASED'
+        self.owners = f'{prefix}:OWNERS'
+        self.done = f'{prefix}:DONE'
+        self.planned = f'{prefix}:PLANNED'
+
+    def plan(self, start_block: int, till_block: int,
+             size: int = SEGMENT_SIZE) -> int:
+        """
+        Returns:
+            int: how many new segments were added, up to and including
+                `till_block`.
+        """
+        return _PLAN(keys=[self.pending, self.planned],
+                     args=[start_block, till_block, size])
+
+    def claim(self, owner: str,
+              ttl: int = LEASE_SECONDS) -> Optional[Segment]:
+        seg, reclaimed = _CLAIM(
+            keys=[self.pending, self.leased, self.owners],
+            args=[int(time.time() * 1000), ttl * 1000, owner])
+
+        if reclaimed:
+            print(f'[{self.chain}] reclaimed {reclaimed} expired segment '
+                  f'lease(s)')
+
+        return None if seg is None else Segment.parse(seg)
+
+    def heartbeat(self, seg: Segment, owner: str,
+                  ttl: int = LEASE_SECONDS) -> bool:
+        """
+        Returns:
+            bool: False if the lease expired and went to someone else.
+        """
+        return bool(
+            _HEARTBEAT(keys=[self.leased, self.owners],
+                       args=[str(seg), owner,
+                             int((time.time() + ttl) * 1000)]))
+
+    def complete(self, seg: Segment, owner: str) -> bool:
+        ok = bool(
+            _COMPLETE(keys=[self.leased, self.owners, self.done],
+                     args=[str(seg), owner]))
+
+        if ok:
+            # The segment's own cursor is of no use once it is done.
+            ns = self.cursor_namespace(seg)
+            LOGS_REDIS_URL.delete(
+                CheckpointStore(self.chain, self.address, ns).key,
+                SeenLogs(self.chain, self.address, ns).key)
+
+        return ok
+
+    def abandon(self, seg: Segment, owner: str) -> bool:
+        """Hand `seg` back, the next claim resumes from its cursor."""
+        return bool(
+            _ABANDON(keys=[self.leased, self.owners, self.pending],
+                     args=[str(seg), owner]))
+
+    def cursor_namespace(self, seg: Segment) -> str:
+        return f'{self.key_namespace}:{seg}'
+
+    def unfinished(self) -> int:
+        """
+        Returns:
+            int: how many segments are pending or leased.
+        """
+        pipe = LOGS_REDIS_URL.pipeline(transaction=False)
+        pipe.zcard(self.pending)
+        pipe.zcard(self.leased)
+        return sum(pipe.execute())
+
+    def advance_checkpoint(self, start_block: int) -> Optional[Cursor]:
+        """
+        Move the chain/address' own checkpoint, the one `get_logs` and the
+        head follower use, up to the lowest incomplete block: the end of
+        the done ranges contiguous with it (or with `start_block`).
+
+        Returns:
+            Optional[Cursor]: the checkpoint, None if there is none yet.
+        """
+        checkpoint = CheckpointStore(self.chain, self.address,
+                                     self.key_namespace)
+        cursor = checkpoint.load()
+        # The first block not known to be done. A checkpoint within a block
+        # leaves the rest of it to `get_logs`, no segment starts there.
+        low = start_block if cursor is None else cursor.block + (
+            cursor[1:] == (MAX_LOG_INDEX, MAX_LOG_INDEX))
+        first = low
+
+        for seg in self.coverage():
+            if seg.start > low:
+                break
+            low = max(low, seg.end + 1)
+
+        if low > first:
+            cursor = Cursor(low - 1, MAX_LOG_INDEX, MAX_LOG_INDEX)
+            checkpoint.save(cursor)
+
+        return cursor
+
+    def coverage(self) -> List[Segment]:
+        """
+        Returns:
+            List[Segment]: the completed ranges, merged and in order.
+        """
+        return merge([
+            Segment.parse(raw)
+            for raw in LOGS_REDIS_URL.zrange(self.done, 0, -1)
+        ])
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        pipe = LOGS_REDIS_URL.pipeline(transaction=False)
+        pipe.zcard(self.pending)
+        pipe.zrange(self.leased, 0, -1, withscores=True)
+        pipe.hgetall(self.owners)
+        pipe.get(self.planned)
+        pending, leased, owners, planned = pipe.execute()
+
+        return {
+            'done': [str(seg) for seg in self.coverage()],
+            'pending': pending,
+            'leased': {
+                seg: {
+                    'owner': owners.get(seg),
+                    'expires_in': round(expiry / 1000 - now, 1),
+                }
+                for seg, expiry in leased
+            },
+            'planned_till': None if planned is None else int(planned) - 1,
+        }
+
+
+def default_owner() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def work_segments(chain: str,
+                  address: str,
+                  cb: Callable[..., None],
+                  owner: Optional[str] = None,
+                  ttl: int = LEASE_SECONDS,
+                  key_namespace: str = 'logs',
+                  on_complete: Optional[Callable[[Segment], Any]] = None,
+                  ) -> Tuple[int, int]:
+    """
+    Claim `chain`'s segments one after the other and run `get_logs` over
+    each, from its own cursor, until none is pending.
+
+    Returns:
+        Tuple[int, int]: segments completed and abandoned.
+    """
+    coordinator = SegmentCoordinator(chain, address, key_namespace)
+    owner = owner or default_owner()
+    completed = abandoned = 0
+
+    while (seg := coordinator.claim(owner, ttl)) is not None:
+        print(f'[{chain}] {owner} leased segment {seg}')
+        job = gevent.spawn(get_logs,
+                           chain,
+                           cb,
+                           address,
+                           till_block=seg.end,
+                           key_namespace=key_namespace,
+                           start_blocks={chain: seg.start},
+                           cursor_namespace=coordinator.cursor_namespace(seg))
+
+        lost = False
+
+        while not job.ready():
+            job.join(ttl / 3)
+
+            if not job.ready() and not coordinator.heartbeat(seg, owner, ttl):
+                # Whoever has it now resumes from the segment's cursor.
+                print(f'[{chain}] {owner} lost the lease on segment {seg}')
+                job.kill()
+                lost = True
+
+        if lost:
+            continue
+
+        if job.successful() and job.value:
+            # False only if the lease expired right before, see above.
+            if coordinator.complete(seg, owner):
+                completed += 1
+
+                if on_complete is not None:
+                    on_complete(seg)
+            continue
+
+        if job.exception is not None:
+            print(f'[{chain}] segment {seg} failed: {job.exception}')
+
+        if coordinator.abandon(seg, owner):
+            abandoned += 1
+            # Left for another node, or this one once things recovered.
+            gevent.sleep(ttl / 3)
+
+    return completed, abandoned
+
+
+def backfill_chain(chain: str,
+                   address: str,
+                   cb: Callable[..., None],
+                   start_block: int,
+                   till_block: int,
+                   concurrency: int = SEGMENT_CONCURRENCY,
+                   owner: Optional[str] = None,
+                   size: int = SEGMENT_SIZE,
+                   ttl: int = LEASE_SECONDS,
+                   key_namespace: str = 'logs') -> Optional[Cursor]:
+    """
+    Backfill `[start_block, till_block]` as segments, `concurrency` of them
+    at once, until none is left unfinished by this node or any other. The
+    checkpoint follows the lowest incomplete block as segments complete, so
+    a crash resumes from the segments' own cursors and the ledger.
+
+    Returns:
+        Optional[Cursor]: the checkpoint once everything is done.
+    """
+    coordinator = SegmentCoordinator(chain, address, key_namespace)
+    owner = owner or default_owner()
+    cursor = CheckpointStore(chain, address, key_namespace).load()
+
+    # Segments only hold whole blocks, the one the checkpoint is within is
+    # finished the usual way first.
+    if cursor is not None and cursor[1:] != (MAX_LOG_INDEX, MAX_LOG_INDEX):
+        get_logs(chain,
+                 cb,
+                 address,
+                 till_block=cursor.block,
+                 key_namespace=key_namespace)
+
+    if (n := coordinator.plan(start_block, till_block, size)):
+        print(f'[{chain}] planned {n} new segment(s) up to block '
+              f'{till_block}')
+
+    def advance(_: Segment) -> None:
+        coordinator.advance_checkpoint(start_block)
+
+    while True:
+        jobs = [
+            gevent.spawn(work_segments,
+                         chain,
+                         address,
+                         cb,
+                         f'{owner}/{i}',
+                         ttl,
+                         key_namespace,
+                         on_complete=advance) for i in range(concurrency)
+        ]
+        gevent.joinall(jobs, raise_error=True)
+
+        completed = sum(job.value[0] for job in jobs)
+        abandoned = sum(job.value[1] for job in jobs)
+        cursor = coordinator.advance_checkpoint(start_block)
+        print(f'[{chain}] no segments left to claim: {completed} completed, '
+              f'{abandoned} abandoned here, checkpoint at '
+              f'{None if cursor is None else cursor.block}')
+
+        if not (left := coordinator.unfinished()):
+            return cursor
+
+        # Leased elsewhere, by a node that may never finish them.
+        print(f'[{chain}] waiting on {left} segment(s) leased elsewhere')
+        gevent.sleep(ttl / 3)
+
+
+def backfill(cb: Callable[..., None],
+             chains: List[str],
+             owner: Optional[str] = None,
+             start_blocks: Dict[str, int] = _start_blocks,
+             concurrency: int = SEGMENT_CONCURRENCY) -> None:
+    """
+    Backfill every chain up to its confirmed head from its checkpoint (or
+    start block), alongside whichever other nodes run this.
+    """
+    def run(chain: str) -> None:
+        address = SYN_DATA[chain]['bridge']
+        cursor = CheckpointStore(chain, address).load()
+        start_block = start_blocks[chain] if cursor is None \
+            else max(cursor.block + 1, start_blocks[chain])
+        safe = connect(chain).eth.block_number - CONFIRMATIONS[chain]
+
+        backfill_chain(chain, address, cb, start_block, safe, concurrency,
+                       owner)
+
+    gevent.joinall([gevent.spawn(run, chain) for chain in chains])
@@ -0,0 +1,85 @@
+from typing import Any, Dict, Iterator, Optional
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import time
+
+import gevent
+
+
+# Seconds between attempts at a snapshot lock held elsewhere.
+LOCK_RETRY_SECONDS = 0.05
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    # A lock file next to the snapshot, which itself is replaced on save.
+    with open(f'{path}.lock', 'a') as f:
+        # Never blocking in flock, which would stall every greenlet.
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                gevent.sleep(LOCK_RETRY_SECONDS)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_snapshot(path: str, version: int) -> Optional[Dict[str, Any]]:
+    """
+    Load the JSON snapshot at `path`.
+
+    Returns:
+        Optional[Dict[str, Any]]: None if it does not exist, can't be parsed
+            or was written by another snapshot `version`.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f'ignoring corrupt snapshot {path}: {e}')
+        return None
+
+    if data.get('version') != version:
+        print(f'ignoring snapshot {path}: version {data.get("version")} '
+              f'!= {version}')
+        return None
+
+    return data
+
+
+def save_snapshot(path: str,
+                  version: int,
+                  data: Dict[str, Any],
+                  merge: bool = False) -> None:
+    """
+    Atomically replace the snapshot at `path`, readers never see a partially
+    written file.
+
+    Args:
+        path (str): the snapshot file.
+        version (int): snapshot version, see :func:`load_snapshot`.
+        data (Dict[str, Any]): mapping of mappings to write.
+        merge (bool, optional): re-read the snapshot and only replace the
+            entries of `data`'s mappings in it, under an exclusive lock so
+            processes saving their own entries don't undo each other's.
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+
+    with _locked(path):
+        if merge and (old := load_snapshot(path, version)) is not None:
+            data = {**old, **{k: {**old.get(k, {}), **v}
+                              for k, v in data.items()}}
+
+        data = {**data, 'version': version, 'created': int(time.time())}
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+        os.replace(tmp, path)
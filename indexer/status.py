@@ -0,0 +1,77 @@
+from typing import Any, Dict, List
+import json
+import time
+import os
+
+import gevent
+
+from indexer.data import CHAIN_HEALTH, LOGS_REDIS_URL, SYN_DATA
+from indexer.checkpoint import CheckpointStore
+from indexer.endpoints import PoolProvider
+
+# Seconds between status reports, a worker missing 3 in a row is gone.
+STATUS_INTERVAL = int(os.getenv('STATUS_INTERVAL', 30))
+_PREFIX = 'indexer:status'
+
+
+def chain_status(chain: str) -> Dict[str, Any]:
+    cursor = CheckpointStore(chain, SYN_DATA[chain]['bridge']).load()
+    provider = SYN_DATA[chain]['w3'].provider
+
+    return {
+        'health': str(CHAIN_HEALTH[chain]['health']),
+        'error': CHAIN_HEALTH[chain]['error'],
+        'block': cursor.block if cursor is not None else None,
+        'endpoints': provider.pool.stats()
+        if isinstance(provider, PoolProvider) else [],
+        'hedging': provider.hedging.stats() if isinstance(
+            provider, PoolProvider) and provider.hedging else None,
+    }
+
+
+def report_status(worker: str,
+                  chains: List[str],
+                  interval: int = STATUS_INTERVAL) -> None:
+    """
+    Publish `chains`' health and checkpoint block under `worker` every
+    `interval` seconds, meant to be spawned.
+    """
+    key = f'{_PREFIX}:{worker}'
+
+    while True:
+        try:
+            LOGS_REDIS_URL.hset(key,
+                                mapping={
+                                    'pid': os.getpid(),
+                                    'updated': int(time.time()),
+                                    'chains': json.dumps({
+                                        chain: chain_status(chain)
+                                        for chain in chains
+                                    }),
+                                })
+            LOGS_REDIS_URL.expire(key, 3 * interval)
+        except Exception as e:
+            print(f'failed to report status: {e}')
+
+        gevent.sleep(interval)
+
+
+def collect_status() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns:
+        Dict[str, Dict[str, Any]]: the last report of every live worker,
+            by worker name.
+    """
+    res: Dict[str, Dict[str, Any]] = {}
+
+    for key in LOGS_REDIS_URL.scan_iter(f'{_PREFIX}:*'):
+        report = LOGS_REDIS_URL.hgetall(key)
+
+        if report:
+            res[key[len(_PREFIX) + 1:]] = {
+                'pid': int(report['pid']),
+                'updated': int(report['updated']),
+                'chains': json.loads(report['chains']),
+            }
+
+    return res
@@ -0,0 +1,158 @@
+from typing import List, Optional
+import subprocess
+import signal
+import time
+import sys
+import os
+
+from indexer.data import SYN_DATA
+from indexer.db import ensure_indexes
+from indexer.status import STATUS_INTERVAL, collect_status
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'main.py')
+# A worker up for this long is considered recovered, its backoff resets.
+STABLE_SECONDS = 60
+
+
+def partition(chains: List[str], workers: int,
+              groups: Optional[str] = None) -> List[List[str]]:
+    """
+    Split `chains` across processes, as given by `groups` (e.g.
+    `ethereum,bsc;polygon`, anything not listed gets a process of its own)
+    or round-robin across `workers` processes.
+    """
+    if groups:
+        res = [[c for c in g.split(',') if c] for g in groups.split(';')]
+        res = [g for g in res if g]
+        listed = {c for g in res for c in g}
+
+        if (unknown := listed - set(chains)):
+            raise ValueError(f'unknown chains in groups: {unknown}')
+
+        return res + [[c] for c in chains if c not in listed]
+
+    workers = max(1, min(workers, len(chains)))
+    return [chains[i::workers] for i in range(workers)]
+
+
+class Worker:
+    """
+    One `main.py` process indexing `chains`, restarted with exponential
+    backoff whenever it exits.
+    """
+    def __init__(self, name: str, chains: List[str],
+                 max_delay: int = 60) -> None:
+        self.name = name
+        self.chains = chains
+        self.max_delay = max_delay
+        self.proc: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.started = 0.0
+        self.delay = 1
+        # When to start again after an exit, 0 while running.
+        self.restart_at = 0.0
+
+    def start(self) -> None:
+        self.proc = subprocess.Popen([sys.executable, MAIN],
+                                     env={
+                                         **os.environ,
+                                         'INDEXER_CHAINS': ','.join(
+                                             self.chains),
+                                         'INDEXER_WORKER': self.name,
+                                     })
+        self.started = time.time()
+        print(f'{self.name} started (pid {self.proc.pid}): '
+              f'{", ".join(self.chains)}')
+
+    def check(self) -> None:
+        if self.proc is None:
+            return
+
+        if self.restart_at:
+            if time.time() >= self.restart_at:
+                self.restart_at = 0
+                self.restarts += 1
+                self.start()
+            return
+
+        if (code := self.proc.poll()) is None:
+            return
+
+        if time.time() - self.started >= STABLE_SECONDS:
+            self.delay = 1
+
+        print(f'{self.name} exited with {code}, restarting in {self.delay}s')
+        self.restart_at = time.time() + self.delay
+        self.delay = min(self.delay * 2, self.max_delay)
+
+    def stop(self, timeout: float = 10) -> None:
+        if self.proc is None or self.proc.poll() is not None:
+            return
+
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def print_status(workers: List[Worker]) -> None:
+    reports = collect_status()
+
+    for w in workers:
+        report = reports.get(w.name)
+
+        if report is None:
+            print(f'{w.name}: no report ({w.restarts} restarts)')
+            continue
+
+        age = time.time() - report['updated']
+        chains = ', '.join(
+            f'{chain} {s["health"]}@{s["block"]}'
+            for chain, s in report['chains'].items())
+        print(f'{w.name} pid {report["pid"]} ({age:.0f}s ago, '
+              f'{w.restarts} restarts): {chains}')
+
+
+def supervise(groups: List[List[str]], interval: float = 1) -> None:
+    workers = [Worker(f'worker-{i}', g) for i, g in enumerate(groups)]
+    stopping = False
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for w in workers:
+        w.start()
+
+    last_status = time.time()
+
+    try:
+        while not stopping:
+            for w in workers:
+                w.check()
+
+            if time.time() - last_status >= STATUS_INTERVAL:
+                last_status = time.time()
+                try:
+                    print_status(workers)
+                except Exception as e:
+                    print(f'failed to collect status: {e}')
+
+            time.sleep(interval)
+    finally:
+        for w in workers:
+            w.stop()
+
+
+def main() -> None:
+    groups = partition(list(SYN_DATA),
+                       int(os.getenv('WORKERS', os.cpu_count() or 1)),
+                       os.getenv('CHAIN_GROUPS'))
+
+    # Once here rather than racing in every worker.
+    ensure_indexes()
+    supervise(groups)
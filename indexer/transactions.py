@@ -1,100 +1,161 @@
+import struct
 import sys
-from typing import (Optional, Dict, get_args, Any)
-from dataclasses import dataclass, fields
-from decimal import Decimal
+from typing import (Callable, Optional, Dict, get_args, Any, ClassVar, List,
+                    Tuple)
+from dataclasses import dataclass, field, fields
+from decimal import Context, Decimal
 from bson import Decimal128
-from attr import field
 
 from hexbytes import HexBytes
 
 from indexer.data import TOKEN_DECIMALS, CHAINS, TOKEN_SYMBOLS
 from indexer.helpers import handle_decimals
 
+# Set in `__post_init__` from the token metadata, not validated.
+_DERIVED = ('sent_token_symbol', 'sent_value_formatted',
+            'received_token_symbol', 'received_value_formatted')
+
+# (field name, annotation, accepted types, whether strings are parsed as int)
+_Plan = List[Tuple[str, Any, Tuple[type, ...], bool]]
+
+
+def _compile(cls: type) -> _Plan:
+    plan = []
+
+    for f in fields(cls):
+        if f.name in _DERIVED:
+            continue
+
+        types = get_args(f.type) or (f.type, )
+        plan.append((f.name, f.type, types, int in types))
+
+    return plan
+
+
+def _big_int(v: int) -> Any:
+    # MongoDB cannot handle ints more than 8 bytes
+    return str(v) if v > sys.maxsize else v
+
+
+_D128_CONTEXT = Context(prec=34)
+_pack_bid = struct.Struct('<QQ').pack
+
+
+def _decimal128(v: Decimal) -> Decimal128:
+    """
+    Same as `Decimal128(v)`, which rounds through a decimal128 context on
+    every call. Values that fit as they are (all of ours) are encoded
+    straight to the BID layout instead.
+    """
+    sign, digits, exponent = v.as_tuple()
+
+    if (len(digits) > 34 or not isinstance(exponent, int)
+            or not -6176 <= exponent <= 6111):
+        return Decimal128(v)
+
+    coefficient = abs(int(v.scaleb(-exponent, _D128_CONTEXT)))
+    return Decimal128.from_bid(
+        _pack_bid(coefficient & 0xFFFFFFFFFFFFFFFF,
+                  sign << 63 | (exponent + 6176) << 49 | coefficient >> 64))
+
+
+# How a value is made BSON-ready, by the (non-None) type it is annotated as.
+_converters: Dict[type, Callable[[Any], Any]] = {
+    # MongoDB cannot handle Decimal type
+    Decimal: _decimal128,
+    HexBytes: lambda v: '0x' + bytes.hex(v),
+    int: _big_int,
+}
+
+_Serializer = Tuple[Tuple[str, Optional[Callable[[Any], Any]]], ...]
+
+
+def _compile_serializer(cls: type) -> _Serializer:
+    plan = []
+
+    for f in fields(cls):
+        types = [
+            t for t in get_args(f.type) or (f.type, ) if t is not type(None)
+        ]
+        assert len(types) == 1, f'{cls.__name__}.{f.name}: {f.type}'
+
+        plan.append((f.name, _converters.get(types[0])))
+
+    return tuple(plan)
+
 
 class Base:
+    __slots__ = ()
+
+    # Names of the fields, in declaration order.
+    _names: ClassVar[Tuple[str, ...]]
+    # What `__post_init__` validates, worked out once per class.
+    _plan: ClassVar[_Plan]
+    # Each field with its conversion for `serialize`, None if stored as is.
+    _serializer: ClassVar[_Serializer]
+
+    def _format(self, prefix: str, chain_id_field: str) -> None:
+        token = getattr(self, f'{prefix}_token')
+
+        if token is not None:
+            chain = CHAINS[getattr(self, chain_id_field)]
+            token = HexBytes(token)
+            setattr(self, f'{prefix}_token', token)
+
+            setattr(self, f'{prefix}_token_symbol',
+                    TOKEN_SYMBOLS[chain][token.hex()])
+            setattr(
+                self, f'{prefix}_value_formatted',
+                handle_decimals(getattr(self, f'{prefix}_value'),
+                                TOKEN_DECIMALS[chain][token.hex()]))
+        else:
+            setattr(self, f'{prefix}_token_symbol', None)
+            setattr(self, f'{prefix}_value_formatted', None)
+
     def __post_init__(self) -> None:
+        cls = type(self)
+
         # Handle token decimals.
-        if 'received_token' in self.__dict__:
-            chain = CHAINS[self.__dict__['to_chain_id']]
-            initial = self.__dict__['received_value']
-            token = self.__dict__['received_token']
-
-            if token is not None:
-                self.received_token = HexBytes(token)
-                decimals = TOKEN_DECIMALS[chain][self.received_token.hex()]
-                symbol = TOKEN_SYMBOLS[chain][self.received_token.hex()]
-
-                self.received_token_symbol = symbol
-                self.received_value_formatted = handle_decimals(
-                    initial,
-                    decimals,
-                )
-            else:
-                self.received_token_symbol = None
-                self.received_value_formatted = None
-
-        if 'sent_token' in self.__dict__:
-            chain = CHAINS[self.__dict__['from_chain_id']]
-            initial = self.__dict__['sent_value']
-            token = self.__dict__['sent_token']
-
-            if token is not None:
-                self.sent_token = HexBytes(token)
-                decimals = TOKEN_DECIMALS[chain][self.sent_token.hex()]
-                symbol = TOKEN_SYMBOLS[chain][self.sent_token.hex()]
-
-                self.sent_token_symbol = symbol
-                self.sent_value_formatted = handle_decimals(
-                    initial,
-                    decimals,
-                )
-            else:
-                self.sent_token_symbol = None
-                self.sent_value_formatted = None
+        if 'received_token' in cls._names:
+            self._format('received', 'to_chain_id')
 
-        for field in fields(self):
-            if field.name in [
-                    'sent_token_symbol', 'sent_value_formatted',
-                    'received_token_symbol', 'received_value_formatted'
-            ]:
-                continue
+        if 'sent_token' in cls._names:
+            self._format('sent', 'from_chain_id')
 
-            val = self.__dict__[field.name]
+        for name, annotation, types, int_like in cls._plan:
+            val = getattr(self, name)
 
             # Pscyopg returns psql's bytea as bytes.
             if type(val) == bytes:
-                self.__dict__[field.name] = HexBytes(val)
+                setattr(self, name, HexBytes(val))
             # We store ints as varchars in psql due to BIGINT's limitations.
-            elif type(val) == str and (field.type == int
-                                       or get_args(field.type)[0] == int):
-                self.__dict__[field.name] = int(val)
-            elif not isinstance(val, get_args(field.type) or field.type):
-                raise TypeError(f'expected {field.name!r} to be of type '
-                                f'{field.type} not {type(val)}')
+            elif type(val) == str and int_like:
+                setattr(self, name, int(val))
+            elif not isinstance(val, types):
+                raise TypeError(f'expected {name!r} to be of type '
+                                f'{annotation} not {type(val)}')
 
     def serialize(self, include_none=False) -> Dict[str, Any]:
         """
-        :return: Dict with keys and values as string.
-        Converts Decimal to Decimal128 for MongoDB
+        :return: Dict ready to be BSON encoded, Decimal as Decimal128 and
+        HexBytes as hex strings. None values are left out unless
+        `include_none`, they mess with indexing, rewriting values.
         """
         res = {}
-        for k, v in self.__dict__.items():
-            # MongoDB cannot handle Decimal type
-            if isinstance(v, Decimal):
-                res[k] = Decimal128(v)
-            elif isinstance(v, HexBytes):
-                res[k] = v.hex()
-            # MongoDB cannot handle ints more than 8 bytes
-            elif isinstance(v, int) and v > sys.maxsize:
-                res[k] = str(v)
-            else:
-                # Don't include empty keys. This messes with indexing, rewriting values
-                if include_none is False and v is not None:
+        for k, conv in self._serializer:
+            v = getattr(self, k)
+
+            if v is None:
+                if include_none:
                     res[k] = v
+            elif conv is None:
+                res[k] = v
+            else:
+                res[k] = conv(v)
         return res
 
 
-@dataclass
+@dataclass(slots=True)
 class LostTransaction(Base):
     to_tx_hash: HexBytes
     to_address: HexBytes
@@ -108,7 +169,7 @@ class LostTransaction(Base):
     received_token_symbol: str = field(init=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Transaction(Base):
     from_tx_hash: HexBytes
     to_tx_hash: Optional[HexBytes]
@@ -129,3 +190,9 @@ class Transaction(Base):
     received_token_symbol: Optional[str] = field(init=False)
     sent_value_formatted: Decimal = field(init=False)
     sent_token_symbol: str = field(init=False)
+
+
+for _cls in (LostTransaction, Transaction):
+    _cls._names = tuple(f.name for f in fields(_cls))
+    _cls._plan = _compile(_cls)
+    _cls._serializer = _compile_serializer(_cls)
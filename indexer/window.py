@@ -0,0 +1,159 @@
+from typing import Any, Dict, Optional
+import hashlib
+import time
+import os
+
+from requests.exceptions import RequestException
+
+from indexer.endpoints import PoolProvider, Throttled
+from indexer.data import LOGS_REDIS_URL
+
+MAX_BLOCKS = 2048
+MIN_BLOCKS = 16
+# Never grow past this, even on chains where ranges are effectively unbounded.
+WINDOW_MAX_BLOCKS = int(os.getenv('WINDOW_MAX_BLOCKS', 100_000))
+# Shrink when a window returns more logs than this, grow while it returns
+# less than a quarter of it within `WINDOW_FAST_SECONDS`.
+WINDOW_TARGET_LOGS = int(os.getenv('WINDOW_TARGET_LOGS', 500))
+WINDOW_FAST_SECONDS = float(os.getenv('WINDOW_FAST_SECONDS', 2))
+# How long the smallest window a provider rejected stays a ceiling. Not for
+# ever: a cap on results depends on how dense the range's logs are.
+WINDOW_CEILING_SECONDS = int(os.getenv('WINDOW_CEILING_SECONDS', 3600))
+
+# Starting points until a size is learned, these are what providers
+# historically accepted.
+_initial_windows: Dict[str, int] = {
+    'harmony': 1024,
+    'ethereum': 1024,
+    'moonriver': 1024,
+    'moonbeam': 1024,
+    'cronos': 2000,
+    'boba': 512,
+    'bsc': 512,
+}
+
+# Lowercased fragments of the JSON-RPC errors providers return when a range
+# is too wide, yields too many results or takes the node too long, e.g.
+# "query returned more than 10000 results", "exceed maximum block range:
+# 5000", "block range is too wide (maximum 1024)", "Log response size
+# exceeded", "requested too many blocks from 0 to 5000, maximum is set to
+# 2048", "GetLogs query must be smaller than size 1024".
+_range_errors = (
+    'query returned more than',
+    'block range',
+    'range is too',
+    'range too large',
+    'max allowed range',
+    'too many blocks',
+    'response size exceeded',
+    'query must be smaller than',
+    'query timeout',
+    'execution timeout',
+)
+
+
+def is_range_error(e: Exception) -> bool:
+    """
+    Whether `e` is a node's answer that the range asked for is too much.
+    Errors talking to the node (connection errors, timeouts and 429s) never
+    are, however they are worded.
+    """
+    if isinstance(e, (RequestException, Throttled)):
+        return False
+
+    msg = str(e).lower()
+    # Throttling is not the range's fault.
+    if '429' in msg or 'rate limit' in msg:
+        return False
+
+    return any(x in msg for x in _range_errors)
+
+
+def window_endpoint(provider: Any) -> str:
+    """
+    What a provider's window is learned for: its endpoint, or all of an
+    endpoint pool's. A range goes to whichever endpoint of the pool is best
+    at the time, so the strictest one's limits are the pool's.
+    """
+    if isinstance(provider, PoolProvider):
+        return ','.join(e.url for e in provider.pool.endpoints)
+
+    return provider.endpoint_uri
+
+
+class WindowController:
+    """
+    Adaptive `eth_getLogs` block range for a chain/endpoint pair, see
+    :func:`window_endpoint`.
+
+    Doubles the window while responses are small and fast, halves it on
+    "range too large"-like errors, node-side query timeouts or oversized
+    results. A window that was rejected is a ceiling for
+    `WINDOW_CEILING_SECONDS`, growing stops short of it rather than failing
+    every other call against a provider's hard limit. The learned size and
+    ceiling are kept in redis so a restart resumes from them.
+    """
+    def __init__(self,
+                 chain: str,
+                 endpoint: str,
+                 initial: Optional[int] = None,
+                 key_namespace: str = 'logs') -> None:
+        # Endpoints may embed API keys, don't leak them into redis keys.
+        _endpoint = hashlib.sha1(endpoint.encode()).hexdigest()[:12]
+        self.key = f'{chain}:{key_namespace}:{_endpoint}:WINDOW'
+        self.ceiling_key = f'{self.key}_CEILING'
+
+        if (ret := LOGS_REDIS_URL.get(self.key)) is not None:
+            self.size = int(ret)
+        else:
+            self.size = initial or _initial_windows.get(chain, MAX_BLOCKS)
+
+        self.ceiling: Optional[int] = None
+        self.ceiling_until = 0.0
+        if (ret := LOGS_REDIS_URL.get(self.ceiling_key)) is not None:
+            self.ceiling = int(ret)
+            self.ceiling_until = time.time() + max(
+                LOGS_REDIS_URL.ttl(self.ceiling_key), 0)
+
+    def _set(self, size: int) -> None:
+        if self.ceiling is not None and time.time() >= self.ceiling_until:
+            self.ceiling = None
+        if self.ceiling is not None:
+            size = min(size, self.ceiling - 1)
+
+        size = min(max(size, MIN_BLOCKS), WINDOW_MAX_BLOCKS)
+
+        if size != self.size:
+            self.size = size
+            LOGS_REDIS_URL.set(self.key, size)
+
+    def update(self, logs: int, elapsed: float) -> None:
+        """
+        Feed back a successful `eth_getLogs` call.
+        """
+        if logs > WINDOW_TARGET_LOGS:
+            self._set(self.size // 2)
+        elif logs < WINDOW_TARGET_LOGS // 4 and elapsed < WINDOW_FAST_SECONDS:
+            self._set(self.size * 2)
+
+    def shrink(self, e: Exception) -> bool:
+        """
+        Feed back a failed `eth_getLogs` call.
+
+        Returns:
+            bool: whether the same range should be retried with the new,
+                smaller window. False if the error is not range related
+                or the window can't shrink any further.
+        """
+        if not is_range_error(e) or self.size <= MIN_BLOCKS:
+            return False
+
+        if self.ceiling is None or self.size < self.ceiling:
+            self.ceiling = self.size
+            self.ceiling_until = time.time() + WINDOW_CEILING_SECONDS
+            LOGS_REDIS_URL.set(self.ceiling_key,
+                               self.ceiling,
+                               ex=WINDOW_CEILING_SECONDS)
+
+        self._set(self.size // 2)
+        return True
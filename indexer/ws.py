@@ -0,0 +1,81 @@
+from typing import Any, Dict, Iterator, List, Optional
+import json
+
+import websocket
+
+
+class SubscriptionError(Exception):
+    pass
+
+
+class Subscription:
+    """
+    An `eth_subscribe` over a WebSocket, e.g. `['newHeads']`, yields the
+    raw results as the node pushes them. Any connection error is raised to
+    the caller, who is expected to resubscribe.
+    """
+    def __init__(self,
+                 url: str,
+                 params: List[Any],
+                 timeout: float = 30) -> None:
+        self.url = url
+        self.params = params
+        self.timeout = timeout
+        self.id: Optional[str] = None
+        self._ws: Optional[websocket.WebSocket] = None
+
+    def __enter__(self) -> 'Subscription':
+        self.connect()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _request(self, method: str, params: list) -> Any:
+        assert self._ws is not None
+        self._ws.send(
+            json.dumps({
+                'jsonrpc': '2.0',
+                'id': 1,
+                'method': method,
+                'params': params,
+            }))
+
+        # Nothing is subscribed yet, the first message is our answer.
+        resp = json.loads(self._ws.recv())
+        if 'error' in resp:
+            raise SubscriptionError(f'{method} failed: {resp["error"]}')
+
+        return resp['result']
+
+    def connect(self) -> None:
+        self._ws = websocket.create_connection(self.url,
+                                               timeout=self.timeout)
+        self.id = self._request('eth_subscribe', self.params)
+
+    def close(self) -> None:
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        assert self._ws is not None
+
+        while True:
+            try:
+                raw = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # Quiet chains can go a while between blocks, make sure the
+                # connection is still alive rather than giving up on it.
+                self._ws.ping()
+                continue
+
+            if not raw:
+                raise SubscriptionError(f'{self.url} closed the connection')
+
+            msg: Dict[str, Any] = json.loads(raw)
+            params = msg.get('params', {})
+
+            if (msg.get('method') == 'eth_subscription'
+                    and params.get('subscription') == self.id):
+                yield params['result']
@@ -1,12 +1,33 @@
+import os
+
+# Cooperative I/O: sockets must be patched before anything imports `requests`
+# (web3's HTTPProvider), `redis` or `pymongo`, otherwise every RPC/DB call
+# blocks the whole hub and chains are effectively indexed one call at a time.
+# `indexer.data` opens its clients at import, so this has to run first.
+# Set `COOPERATIVE_IO=false` to get the old serialized behaviour.
+if os.getenv('COOPERATIVE_IO', 'true').lower() not in ('0', 'false', 'no'):
+    from gevent import monkey
+    monkey.patch_all()
+
 import gevent
-from indexer.helpers import dispatch_get_logs
 from indexer.rpc import bridge_callback
+from indexer.db import ensure_indexes
+from indexer.data import INDEXER_CHAINS, refresh_metadata
+from indexer.status import report_status
 from indexer import poll
 
 if __name__ == '__main__':
+    # Set when started by `supervisor.py`, which built the indexes already.
+    worker = os.getenv('INDEXER_WORKER')
+
+    if worker is None:
+        ensure_indexes()
+
     gevent.joinall([
-        # Gets new events
-        gevent.spawn(poll.start, bridge_callback),
-        # Backfill events
-        gevent.spawn(dispatch_get_logs, bridge_callback)
+        # Backfill, then follow new events, from one checkpoint per chain
+        gevent.spawn(poll.start, bridge_callback, INDEXER_CHAINS),
+        # Keep the token/pool metadata snapshot in sync with chain
+        gevent.spawn(refresh_metadata),
+        # Health and progress, aggregated by `supervisor.py`
+        gevent.spawn(report_status, worker or 'main', INDEXER_CHAINS),
     ])
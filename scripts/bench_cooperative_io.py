@@ -0,0 +1,90 @@
+"""
+Synthetic comparison of `COOPERATIVE_IO=false` and `COOPERATIVE_IO=true`:
+`CHAINS` greenlets, one per chain as `main.py` runs them, each making
+`CALLS` sequential `eth_blockNumber` requests through web3 against a local
+node answering in `LATENCY` seconds.
+
+    python -m scripts.bench_cooperative_io
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAINS = int(os.getenv('BENCH_CHAINS', 15))
+CALLS = int(os.getenv('BENCH_CALLS', 20))
+LATENCY = float(os.getenv('BENCH_LATENCY', 0.05))
+
+
+class _Node(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(LATENCY)
+
+        res = json.dumps({'jsonrpc': '2.0', 'id': body['id'], 'result': '0x1'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(res)))
+        self.end_headers()
+        self.wfile.write(res.encode())
+
+
+def client(url: str) -> None:
+    """One run in this process, patched or not as per `COOPERATIVE_IO`."""
+    if os.getenv('COOPERATIVE_IO', 'true').lower() not in ('0', 'false', 'no'):
+        from gevent import monkey
+        monkey.patch_all()
+
+    import gevent
+    from web3 import Web3, HTTPProvider
+
+    def chain() -> None:
+        w3 = Web3(HTTPProvider(url))
+        for _ in range(CALLS):
+            w3.eth.block_number
+
+    start = time.time()
+    gevent.joinall([gevent.spawn(chain) for _ in range(CHAINS)])
+    print(time.time() - start)
+
+
+def main() -> None:
+    # The node runs in this, unpatched, process so it answers the same way
+    # whichever mode the client is in.
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Node)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    calls = CHAINS * CALLS
+
+    print(f'{CHAINS} chains x {CALLS} calls, {LATENCY * 1000:.0f}ms each '
+          f'(at best {CALLS * LATENCY:.1f}s concurrent, '
+          f'{calls * LATENCY:.1f}s serialized)\n')
+    print('| mode                     | wall time | throughput   |')
+    print('|--------------------------|-----------|--------------|')
+
+    for mode in ('false', 'true'):
+        out = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_cooperative_io', url],
+            env={**os.environ, 'COOPERATIVE_IO': mode},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        elapsed = float(out.split()[-1])
+        print(f'| `COOPERATIVE_IO={mode + "`":<7}  | {elapsed:8.1f}s | '
+              f'{calls / elapsed:4.0f} calls/s  |')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        client(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,95 @@
+"""
+Synthetic comparison of `RPC_HEDGE=false` and `RPC_HEDGE=true`: `CALLS`
+sequential `eth_getTransactionReceipt` requests through a `PoolProvider` of
+two local nodes, each answering in `LATENCY` seconds but stalling `STALL`
+seconds on `STALL_RATE` of requests.
+
+    python -m scripts.bench_hedging
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Probes would add requests of their own.
+os.environ.setdefault('RPC_PROBE_SECONDS', '3600')
+
+from indexer.endpoints import PoolProvider
+
+CALLS = int(os.getenv('BENCH_CALLS', 300))
+LATENCY = float(os.getenv('BENCH_LATENCY', 0.01))
+STALL = float(os.getenv('BENCH_STALL', 2))
+STALL_RATE = float(os.getenv('BENCH_STALL_RATE', 0.03))
+SEED = int(os.getenv('BENCH_SEED', 1))
+
+RECEIPT = '0x' + '11' * 32
+
+
+class _Node(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(STALL if random.random() < STALL_RATE else LATENCY)
+
+        res = json.dumps({'jsonrpc': '2.0', 'id': body['id'], 'result': None})
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(res)))
+            self.end_headers()
+            self.wfile.write(res.encode())
+        except ConnectionError:
+            # The client gave up on it, as it does on the losing hedge.
+            pass
+
+
+def node() -> str:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Node)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def run(urls: list, hedge: bool) -> dict:
+    provider = PoolProvider('bsc', urls, hedge=hedge)
+    latencies = []
+
+    for _ in range(CALLS):
+        start = time.time()
+        provider.make_request('eth_getTransactionReceipt', [RECEIPT])
+        latencies.append(time.time() - start)
+
+    latencies.sort()
+    return {
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'max': latencies[-1],
+        'hedged': provider.hedging.hedged if provider.hedging else 0,
+    }
+
+
+def main() -> None:
+    random.seed(SEED)
+    urls = [node(), node()]
+
+    print(f'{CALLS} sequential receipts, {LATENCY * 1000:.0f}ms each, '
+          f'{STALL * 1000:.0f}ms on {STALL_RATE:.0%} of requests\n')
+    print('| mode              |   p50 |    p99 |    max | hedged |')
+    print('|-------------------|-------|--------|--------|--------|')
+
+    for hedge in (False, True):
+        res = run(urls, hedge)
+        mode = f'`RPC_HEDGE={str(hedge).lower()}`'
+        print(f'| {mode:<17} | {res["p50"] * 1000:3.0f}ms | '
+              f'{res["p99"] * 1000:4.0f}ms | {res["max"] * 1000:4.0f}ms | '
+              f'{res["hedged"]:6} |')
+
+
+if __name__ == '__main__':
+    main()
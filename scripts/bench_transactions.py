@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the records built for every bridge event: `Transaction`
+and `LostTransaction` construction (validation and token formatting
+included), the `Events` tuples and the memory a `Transaction` takes. Run it
+on two revisions to compare them.
+
+    python -m scripts.bench_transactions
+"""
+import timeit
+import tracemalloc
+
+from hexbytes import HexBytes
+
+from indexer.data import CHAINS, TOKEN_DECIMALS, TOKEN_SYMBOLS
+from indexer.transactions import LostTransaction, Transaction
+from indexer.rpc import Events
+
+NUMBER = 5000
+REPEAT = 3
+
+CHAIN_ID, CHAIN = next(iter(CHAINS.items()))
+TOKEN = HexBytes('22' * 20)
+TX_HASH = HexBytes('33' * 32)
+ADDRESS = HexBytes('44' * 20)
+ARGS = {
+    'to': '0x' + '44' * 20,
+    'chainId': 1,
+    'tokenIndexTo': 2,
+    'token': TOKEN.hex(),
+    'amount': 5,
+    'fee': 1,
+    'swapTokenIndex': 1,
+    'swapSuccess': True,
+}
+
+# What `load_metadata` would have fetched for it.
+TOKEN_DECIMALS[CHAIN][TOKEN.hex()] = 18
+TOKEN_SYMBOLS[CHAIN][TOKEN.hex()] = 'TKN'
+
+
+def transaction() -> Transaction:
+    return Transaction(TX_HASH, None, ADDRESS, ADDRESS, 10**20, None, True,
+                       CHAIN_ID, CHAIN_ID, 1, None, None, TOKEN, None,
+                       TX_HASH)
+
+
+def lost_transaction() -> LostTransaction:
+    return LostTransaction(TX_HASH, ADDRESS, 10**20, CHAIN_ID, 1, TOKEN, True,
+                           TX_HASH)
+
+
+def events() -> None:
+    Events.TokenWithdrawAndRemove(ARGS)
+    Events.TokenDeposit(ARGS)
+
+
+def main() -> None:
+    print(f'{NUMBER} iterations, best of {REPEAT}')
+
+    for name, fn in (('Transaction(...)', transaction),
+                     ('LostTransaction(...)', lost_transaction),
+                     ('Events (2 per call)', events)):
+        best = min(timeit.repeat(fn, number=NUMBER, repeat=REPEAT))
+        print(f'  {name:<22} {best / NUMBER * 1e6:6.1f}us')
+
+    tracemalloc.start()
+    txs = [transaction() for _ in range(NUMBER)]
+    size = tracemalloc.get_traced_memory()[0] // len(txs)
+    tracemalloc.stop()
+    print(f'  {"memory per Transaction":<22} {size:6}B')
+
+
+if __name__ == '__main__':
+    main()
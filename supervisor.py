@@ -0,0 +1,13 @@
+import os
+
+# Same as `main.py`, the supervisor itself does little I/O but shares its
+# imports with the workers.
+if os.getenv('COOPERATIVE_IO', 'true').lower() not in ('0', 'false', 'no'):
+    from gevent import monkey
+    monkey.patch_all()
+
+from indexer.supervisor import main
+
+if __name__ == '__main__':
+    # Runs `main.py` once per chain group, see `indexer/supervisor.py`.
+    main()
@@ -0,0 +1,199 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import json
+
+import fakeredis
+import pytest
+
+# Before anything registers its scripts on the real client.
+import indexer.data as data
+data.LOGS_REDIS_URL = fakeredis.FakeRedis(decode_responses=True)
+
+from web3.providers.base import BaseProvider
+from web3 import Web3
+
+from indexer.data import CHAIN_HEALTH, SYN_DATA, TOPICS, Direction, Health
+from indexer.db import MongoManager
+from indexer.endpoints import PoolProvider
+
+CHAIN = 'bsc'
+OUT_TOPIC = next(t for t, d in TOPICS.items() if d == Direction.OUT)
+
+
+class StubProvider(BaseProvider):
+    """
+    Answers the few methods `get_logs` and the head follower need, from a
+    head and the blocks with a log. Blocks from `fork_from` on hash
+    differently every time `fork` is bumped, as after a reorg.
+    """
+    endpoint_uri = 'stub'
+
+    def __init__(self, head: int, logs_at: list, lacks: tuple = ()) -> None:
+        self.head = head
+        self.logs_at = set(logs_at)
+        self.lacks = set(lacks)
+        self.fork = 0
+        self.fork_from = 0
+        self.calls: list = []
+
+    def block_hash(self, block: int) -> str:
+        fork = self.fork if block >= self.fork_from else 0
+        return '0x%064x' % (block + (fork << 128))
+
+    def _block(self, block: int) -> dict:
+        return {
+            'number': hex(block),
+            'hash': self.block_hash(block),
+            'parentHash': self.block_hash(block - 1),
+            'timestamp': hex(block * 3),
+            'transactions': [],
+        }
+
+    def _log(self, block: int) -> dict:
+        address = Web3.toChecksumAddress(SYN_DATA[CHAIN]['bridge'])
+        return {
+            'address': address,
+            'blockHash': self.block_hash(block),
+            'blockNumber': hex(block),
+            'data': '0x',
+            'logIndex': '0x0',
+            'topics': [OUT_TOPIC],
+            'transactionHash': '0x%064x' % (block + 1 << 128),
+            'transactionIndex': '0x0',
+            'removed': False,
+        }
+
+    def make_request(self, method, params):
+        self.calls.append(method)
+
+        if method in self.lacks:
+            return {'jsonrpc': '2.0', 'id': 1,
+                    'error': {'code': -32601, 'message': f'the method '
+                              f'{method} does not exist/is not available'}}
+
+        if method == 'eth_blockNumber':
+            result = hex(self.head)
+        elif method == 'eth_chainId':
+            result = '0x38'
+        elif method == 'eth_getLogs':
+            start = int(params[0]['fromBlock'], 16)
+            end = int(params[0]['toBlock'], 16)
+            result = [self._log(b) for b in sorted(self.logs_at)
+                      if start <= b <= end]
+        elif method == 'eth_getBlockByNumber':
+            block = int(params[0], 16)
+            result = self._block(block) if block <= self.head else None
+        elif method == 'eth_getBlockReceipts':
+            result = []
+        else:
+            return {'jsonrpc': '2.0', 'id': 1,
+                    'error': {'code': -32601, 'message': 'not stubbed'}}
+
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+    def isConnected(self) -> bool:
+        return True
+
+
+class StubNode(StubProvider):
+    """A :class:`StubProvider` served over HTTP on localhost, batches too."""
+    def __init__(self, head: int, logs_at: list, lacks: tuple = ()) -> None:
+        super().__init__(head, logs_at, lacks)
+        # Answers 503 to everything while set.
+        self.down = False
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = json.loads(
+                    self.rfile.read(int(self.headers['Content-Length'])))
+
+                if node.down:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                answer = [node.answer(r) for r in body] \
+                    if isinstance(body, list) else node.answer(body)
+                res = json.dumps(answer).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(res)))
+                self.end_headers()
+                self.wfile.write(res)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def answer(self, request: dict) -> dict:
+        return {
+            **self.make_request(request['method'], request['params']),
+            'id': request['id'],
+        }
+
+
+class _Writer:
+    def flush(self) -> None:
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _redis():
+    data.LOGS_REDIS_URL.flushall()
+    yield
+
+
+def _use(monkeypatch, w3: Web3) -> Web3:
+    monkeypatch.setitem(SYN_DATA[CHAIN], 'w3', w3)
+    monkeypatch.setitem(CHAIN_HEALTH[CHAIN], 'health', Health.HEALTHY)
+    monkeypatch.setattr(MongoManager, 'get_bulk_writer',
+                        staticmethod(lambda: _Writer()))
+    return w3
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """A stubbed, already connected `CHAIN` and a Mongo-less writer."""
+    provider = StubProvider(head=1000, logs_at=[105, 250, 251, 700, 999])
+    _use(monkeypatch, Web3(provider))
+    return provider
+
+
+@pytest.fixture
+def nodes():
+    """Start :class:`StubNode` s, all shut down after the test."""
+    started: list = []
+
+    def start(head: int = 1000, logs_at: tuple = (), **kwargs) -> StubNode:
+        started.append(StubNode(head, list(logs_at), **kwargs))
+        return started[-1]
+
+    yield start
+
+    for node in started:
+        node.server.shutdown()
+        node.server.server_close()
+
+
+@pytest.fixture
+def pooled(monkeypatch):
+    """
+    Connect `CHAIN` through a :class:`PoolProvider` of the given URLs, as in
+    production, with a Mongo-less writer.
+    """
+    providers: list = []
+
+    def use(*urls: str, **kwargs) -> Web3:
+        providers.append(PoolProvider(CHAIN, list(urls), **kwargs))
+        return _use(monkeypatch, Web3(providers[-1]))
+
+    yield use
+
+    for provider in providers:
+        if provider._prober is not None:
+            provider._prober.kill()
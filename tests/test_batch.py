@@ -0,0 +1,64 @@
+from indexer import batch
+from indexer.endpoints import method_not_found
+
+
+def _sent(node) -> list:
+    # Less the probes.
+    return [c for c in node.calls if c != 'eth_blockNumber']
+
+
+def test_endpoint_lacking_block_receipts_is_failed_over(nodes, pooled):
+    lacking = nodes(lacks=('eth_getBlockReceipts', ))
+    full = nodes()
+    w3 = pooled(lacking.url, full.url)
+    # The lacking one is tried first.
+    w3.provider.pool.endpoints[1].latency = 1
+
+    assert batch.supports_block_receipts(w3)
+    assert batch.batch_request(w3, [('eth_getBlockReceipts', ['0x10'])]) \
+        == [[]]
+    assert _sent(lacking) == _sent(full) == ['eth_getBlockReceipts']
+
+    # Known to lack it now, not asked again.
+    assert batch.batch_request(w3, [('eth_getBlockReceipts', ['0x11'])]) \
+        == [[]]
+    assert _sent(lacking) == ['eth_getBlockReceipts']
+    assert batch.supports_block_receipts(w3)
+
+
+def test_no_block_receipts_once_every_endpoint_lacks_them(nodes, pooled):
+    a = nodes(lacks=('eth_getBlockReceipts', ))
+    b = nodes(lacks=('eth_getBlockReceipts', ))
+    w3 = pooled(a.url, b.url)
+
+    # Errors all round come back as missing results.
+    assert batch.batch_request(w3, [('eth_getBlockReceipts', ['0x10'])]) \
+        == [None]
+    assert not batch.supports_block_receipts(w3)
+    assert not batch.supports_block_receipts(w3)
+
+
+def test_only_errors_to_the_optional_method_mark_it_lacking(nodes, pooled):
+    node = nodes()
+    w3 = pooled(node.url)
+
+    # `eth_getCode` isn't stubbed: a "method not found" of its own.
+    assert batch.batch_request(w3, [('eth_getBlockReceipts', ['0x10']),
+                                    ('eth_getCode', ['0x0', '0x10'])]) \
+        == [[], None]
+    assert not w3.provider.pool.endpoints[0].unsupported
+
+
+def test_method_not_found():
+    assert method_not_found({'code': -32601, 'message': 'whatever'})
+    assert method_not_found({
+        'code': -32000,
+        'message': 'the method eth_getBlockReceipts does not exist/is not '
+                   'available'
+    })
+    assert not method_not_found({'code': -32000, 'message': 'not supported'})
+    assert not method_not_found({
+        'code': -32000,
+        'message': 'header for hash does not exist'
+    })
+    assert not method_not_found(None)
@@ -0,0 +1,29 @@
+from indexer.checkpoint import CheckpointStore, Cursor
+
+CHAIN = 'bsc'
+
+
+def test_checkpoint_only_moves_forward():
+    store = CheckpointStore(CHAIN, '0xbridge')
+
+    assert store.save(Cursor(100, 2, 5))
+    # Behind on any of the three fields, in order, or level with it.
+    assert not store.save(Cursor(99, 9, 9))
+    assert not store.save(Cursor(100, 1, 9))
+    assert not store.save(Cursor(100, 2, 4))
+    assert not store.save(Cursor(100, 2, 5))
+    assert store.load() == Cursor(100, 2, 5)
+
+    assert store.save(Cursor(100, 2, 6))
+    assert store.save(Cursor(100, 3, 0))
+    assert store.save(Cursor(101, 0, 0))
+    assert store.load() == Cursor(101, 0, 0)
+
+
+def test_checkpoint_rewinds_unconditionally():
+    store = CheckpointStore(CHAIN, '0xbridge')
+    store.save(Cursor(100, 2, 5))
+
+    store.rewind(Cursor(90, -1, -1))
+    assert store.load() == Cursor(90, -1, -1)
+    assert store.save(Cursor(91, 0, 0))
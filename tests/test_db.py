@@ -0,0 +1,60 @@
+import mongomock
+import gevent
+
+from indexer.db import BulkWriter
+import indexer.db as db
+
+
+class _Result:
+    upserted_count = 1
+    modified_count = 0
+
+
+class _Collection:
+    def __init__(self) -> None:
+        self.writes: list = []
+
+    def bulk_write(self, ops, ordered):
+        self.writes.append(ops)
+        return _Result()
+
+
+def test_bulk_writer_flushes_by_age_without_further_upserts():
+    collection = _Collection()
+    writer = BulkWriter(collection, size=100, interval=0.05)  # type: ignore
+
+    writer.upsert('0x01', {'pending': True})
+    assert collection.writes == []
+
+    gevent.sleep(0.15)
+    assert len(collection.writes) == 1 and len(collection.writes[0]) == 1
+
+
+def test_rollback_undoes_reorged_sides(monkeypatch):
+    collection = mongomock.MongoClient().db.transactions
+    collection.insert_many([
+        # Both sides on this chain, only the OUT one reorged out.
+        {'kappa': 'a', 'from_chain_id': 56, 'from_tx_hash': '0xa1',
+         'sent_value': 1, 'to_chain_id': 56, 'to_tx_hash': '0xa2',
+         'received_value': 1, 'pending': False},
+        # Only its IN side was seen, and that is reorged out.
+        {'kappa': 'b', 'to_chain_id': 56, 'to_tx_hash': '0xb2',
+         'received_value': 1, 'pending': False},
+        # Same hash, other chain.
+        {'kappa': 'c', 'from_chain_id': 1, 'from_tx_hash': '0xa1',
+         'sent_value': 1, 'pending': True},
+    ])
+    monkeypatch.setattr(db.MongoManager, 'get_db_instance',
+                        lambda: collection.database)
+    monkeypatch.setattr(db.MongoManager, 'get_bulk_writer',
+                        lambda: BulkWriter(collection))
+
+    assert db.rollback(56, ['0xa1'], ['0xb2']) == 1
+
+    a = collection.find_one({'kappa': 'a'}, {'_id': 0})
+    assert a == {'kappa': 'a', 'to_chain_id': 56, 'to_tx_hash': '0xa2',
+                 'received_value': 1, 'pending': False}
+    assert collection.find_one({'kappa': 'b'}) is None
+    assert collection.find_one({'kappa': 'c'})['from_tx_hash'] == '0xa1'
+
+    assert db.rollback(56, ['0xa1'], []) == 0
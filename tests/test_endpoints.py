@@ -0,0 +1,21 @@
+def test_failover_past_unreachable_endpoint(nodes, pooled):
+    live = nodes(head=1000)
+    # Nothing listens there.
+    w3 = pooled('http://127.0.0.1:1', live.url)
+    dead = w3.provider.pool.endpoints[0]
+    w3.provider.pool.endpoints[1].latency = 1
+
+    assert w3.eth.block_number == 1000
+    assert dead.consecutive_failures == 1 and dead.failure_rate > 0
+
+
+def test_failover_past_failing_endpoint(nodes, pooled):
+    failing = nodes(head=1000)
+    live = nodes(head=1000)
+    failing.down = True
+    w3 = pooled(failing.url, live.url)
+    w3.provider.pool.endpoints[1].latency = 1
+
+    assert w3.eth.chain_id == 56
+    assert failing.calls == []
+    assert 'eth_chainId' in live.calls
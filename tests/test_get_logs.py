@@ -0,0 +1,79 @@
+import gevent
+
+from indexer.checkpoint import CheckpointStore, MAX_LOG_INDEX
+from indexer.data import SYN_DATA
+from indexer.rpc import get_logs
+from indexer.segments import SegmentCoordinator, backfill_chain
+
+# The chain the `stub` fixture stubs. Not imported from conftest, which
+# would run it again and swap the fake redis the modules already hold.
+CHAIN = 'bsc'
+
+
+def _recorder(seen):
+    def cb(chain, address, log, save_block_index, enrichment):
+        seen.append(log['blockNumber'])
+
+    return cb
+
+
+def test_get_logs_processes_range_and_checkpoints(stub):
+    address = SYN_DATA[CHAIN]['bridge']
+    seen = []
+
+    assert get_logs(CHAIN, _recorder(seen), address, till_block=900,
+                    start_blocks={CHAIN: 100}, batch_size=0)
+    assert seen == [105, 250, 251, 700]
+    assert CheckpointStore(CHAIN, address).load() == \
+        (900, MAX_LOG_INDEX, MAX_LOG_INDEX)
+
+    # Resumes from the checkpoint, up to and including `till_block`.
+    assert get_logs(CHAIN, _recorder(seen), address, till_block=999,
+                    start_blocks={CHAIN: 100}, batch_size=0)
+    assert seen == [105, 250, 251, 700, 999]
+
+
+def test_segmented_backfill_derives_checkpoint(stub):
+    address = SYN_DATA[CHAIN]['bridge']
+    seen = []
+
+    cursor = backfill_chain(CHAIN, address, _recorder(seen), 100, 999,
+                            concurrency=3, size=200, ttl=5)
+
+    assert sorted(seen) == [105, 250, 251, 700, 999]
+    assert cursor == (999, MAX_LOG_INDEX, MAX_LOG_INDEX)
+    assert [str(s) for s in SegmentCoordinator(CHAIN, address).coverage()] \
+        == ['100-999']
+
+
+def test_killed_get_logs_stops_callbacks(stub):
+    address = SYN_DATA[CHAIN]['bridge']
+    started, finished = [], []
+
+    def cb(chain, address, log, save_block_index, enrichment):
+        started.append(log['blockNumber'])
+        gevent.sleep(0.2)
+        finished.append(log['blockNumber'])
+
+    job = gevent.spawn(get_logs, CHAIN, cb, address, till_block=999,
+                       start_blocks={CHAIN: 100}, batch_size=0)
+    while not started and not job.ready():
+        gevent.sleep(0.01)
+    job.kill()
+    gevent.sleep(0.3)
+
+    assert started and not finished
+    assert CheckpointStore(CHAIN, address).load() is None
+
+
+def test_no_prefetch_fetches_inline(stub):
+    address = SYN_DATA[CHAIN]['bridge']
+    fetched = []
+
+    def cb(chain, address, log, save_block_index, enrichment):
+        fetched.append(stub.calls.count('eth_getLogs'))
+
+    assert get_logs(CHAIN, cb, address, till_block=999, max_blocks=100,
+                    start_blocks={CHAIN: 100}, batch_size=0, prefetch=0)
+    # Block 105 is in the first window, nothing was fetched past it yet.
+    assert fetched[0] == 1
@@ -0,0 +1,118 @@
+from indexer.checkpoint import CheckpointStore, Cursor, MAX_LOG_INDEX
+from indexer.data import SYN_DATA
+from indexer.poll import HeadFollower
+from indexer import data, poll
+
+CHAIN = 'bsc'
+
+
+def _follower(seen, monkeypatch, rolled=None) -> HeadFollower:
+    address = SYN_DATA[CHAIN]['bridge']
+    CheckpointStore(CHAIN, address).save(
+        Cursor(100, MAX_LOG_INDEX, MAX_LOG_INDEX))
+
+    def rollback(chain_id, out_txs, in_txs):
+        if rolled is not None:
+            rolled.append((out_txs, in_txs))
+        return 0
+
+    monkeypatch.setattr(poll, 'rollback', rollback)
+
+    def cb(chain, address, log, save_block_index, enrichment):
+        seen.append(log['blockNumber'])
+
+    return HeadFollower(CHAIN, address, cb, confirmations=0, block_time=1)
+
+
+def test_reorg_check_fetches_only_newest_block(nodes, pooled, monkeypatch):
+    node = nodes(head=110, logs_at=[103, 105])
+    pooled(node.url)
+    seen, rolled = [], []
+    follower = _follower(seen, monkeypatch, rolled)
+
+    follower.tick()
+    assert seen == [103, 105]
+
+    # Nothing reorged: one block checked, however many are tracked.
+    node.head = 112
+    node.calls.clear()
+    follower.tick()
+    assert node.calls.count('eth_getBlockByNumber') == 2  # + the new header
+    assert seen == [103, 105] and rolled == []
+
+    # From 105 on: walked back to the fork, rolled back and redone.
+    node.fork, node.fork_from = 1, 105
+    follower.tick()
+    assert rolled == [(['0x%064x' % (106 << 128)], [])]
+    assert seen == [103, 105, 105]
+    assert CheckpointStore(CHAIN, SYN_DATA[CHAIN]['bridge']).load() == \
+        (112, MAX_LOG_INDEX, MAX_LOG_INDEX)
+
+
+def _once(func, *args, **kwargs):
+    # `retry` without the backoff.
+    try:
+        return func(*args)
+    except Exception:
+        return None
+
+
+def test_failed_log_retried_until_checkpoint_released(nodes, pooled,
+                                                      monkeypatch):
+    node = nodes(head=110, logs_at=[103, 105])
+    pooled(node.url)
+    monkeypatch.setattr(poll, 'retry', _once)
+    seen, failures = [], [2]
+
+    follower = _follower(seen, monkeypatch)
+    cb = follower.cb
+
+    def flaky(chain, address, log, **kwargs):
+        if log['blockNumber'] == 103 and failures[0]:
+            failures[0] -= 1
+            raise RuntimeError('db down')
+        cb(chain, address, log, **kwargs)
+
+    follower.cb = flaky
+    checkpoint = CheckpointStore(CHAIN, SYN_DATA[CHAIN]['bridge'])
+
+    follower.tick()
+    assert seen == [105] and follower.stalled
+    assert checkpoint.load() == (102, MAX_LOG_INDEX, MAX_LOG_INDEX)
+
+    follower.tick()
+    assert seen == [105] and follower.stalled
+
+    follower.tick()
+    assert seen == [105, 103] and not follower.stalled
+    assert checkpoint.load() == (110, MAX_LOG_INDEX, MAX_LOG_INDEX)
+    # Trimmed again once released.
+    assert data.LOGS_REDIS_URL.zcard(follower.seen.key) == 0
+
+
+def test_reorg_clears_failed_logs_of_orphaned_blocks(nodes, pooled,
+                                                     monkeypatch):
+    node = nodes(head=110, logs_at=[103, 105])
+    pooled(node.url)
+    monkeypatch.setattr(poll, 'retry', _once)
+    seen = []
+
+    follower = _follower(seen, monkeypatch)
+    cb = follower.cb
+    orphaned = node.block_hash(105)
+
+    def fails_on_orphan(chain, address, log, **kwargs):
+        if log['blockHash'].hex() == orphaned:
+            raise RuntimeError('bad block')
+        cb(chain, address, log, **kwargs)
+
+    follower.cb = fails_on_orphan
+
+    follower.tick()
+    assert seen == [103] and follower.stalled
+
+    node.fork, node.fork_from = 1, 104
+    follower.tick()
+    assert seen == [103, 105] and not follower.stalled
+    assert CheckpointStore(CHAIN, SYN_DATA[CHAIN]['bridge']).load() == \
+        (110, MAX_LOG_INDEX, MAX_LOG_INDEX)
@@ -0,0 +1,45 @@
+from indexer.segments import Segment, SegmentCoordinator
+
+CHAIN = 'bsc'
+
+
+def test_segments_are_planned_once():
+    coordinator = SegmentCoordinator(CHAIN, '0xbridge')
+
+    assert coordinator.plan(0, 249, size=100) == 3
+    assert coordinator.plan(0, 249, size=100) == 0
+    assert coordinator.plan(0, 299, size=100) == 1
+
+    claimed = [coordinator.claim('a') for _ in range(5)]
+    assert claimed == [Segment(0, 99), Segment(100, 199), Segment(200, 249),
+                       Segment(250, 299), None]
+
+
+def test_expired_lease_is_reclaimed_and_fenced():
+    coordinator = SegmentCoordinator(CHAIN, '0xbridge')
+    coordinator.plan(0, 99, size=100)
+
+    # Expires right away, as if `a` stopped heartbeating.
+    seg = coordinator.claim('a', ttl=0)
+    assert seg == Segment(0, 99)
+    assert coordinator.claim('b') == seg
+
+    # `a` can no longer touch it.
+    assert not coordinator.heartbeat(seg, 'a')
+    assert not coordinator.abandon(seg, 'a')
+    assert not coordinator.complete(seg, 'a')
+    assert coordinator.unfinished() == 1
+
+    assert coordinator.heartbeat(seg, 'b')
+    assert coordinator.complete(seg, 'b')
+    assert coordinator.unfinished() == 0
+    assert coordinator.coverage() == [seg]
+
+
+def test_abandoned_segment_is_claimed_again():
+    coordinator = SegmentCoordinator(CHAIN, '0xbridge')
+    coordinator.plan(0, 199, size=100)
+
+    first = coordinator.claim('a')
+    assert coordinator.abandon(first, 'a')
+    assert coordinator.claim('b') == first
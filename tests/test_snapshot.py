@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+import gevent
+
+from indexer.snapshot import load_snapshot, save_snapshot
+
+# Another process saving: holds the lock for a while.
+HOLD = '''
+import fcntl, sys, time
+f = open(sys.argv[1], 'a')
+fcntl.flock(f, fcntl.LOCK_EX)
+print('locked', flush=True)
+time.sleep(0.3)
+'''
+
+
+def test_merge_waits_for_lock_without_blocking_the_hub(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    save_snapshot(path, 1, {'a': {'x': 1}})
+
+    holder = subprocess.Popen([sys.executable, '-c', HOLD, f'{path}.lock'],
+                              stdout=subprocess.PIPE)
+    assert holder.stdout.readline() == b'locked\n'
+
+    job = gevent.spawn(save_snapshot, path, 1, {'a': {'y': 2}}, True)
+    ticks = gevent.spawn(lambda: [gevent.sleep(0.01) for _ in range(5)])
+
+    # Other greenlets ran while the save waited.
+    ticks.join()
+    assert not job.ready()
+
+    job.get(timeout=2)
+    holder.wait()
+    assert load_snapshot(path, 1)['a'] == {'x': 1, 'y': 2}
@@ -0,0 +1,53 @@
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from indexer.endpoints import PoolProvider, Throttled
+from indexer.window import WindowController, is_range_error, window_endpoint
+
+
+def test_provider_range_errors():
+    for message in (
+            'query returned more than 10000 results',
+            'exceed maximum block range: 5000',
+            'block range is too wide (maximum 1024)',
+            'Log response size exceeded. You can make eth_getLogs requests '
+            'with up to a 2K block range',
+            'requested too many blocks from 0 to 5000, maximum is set to 2048',
+            'GetLogs query must be smaller than size 1024',
+    ):
+        assert is_range_error(ValueError({'code': -32000, 'message': message}))
+
+
+def test_transport_errors_are_not_range_errors():
+    assert not is_range_error(
+        ConnectionError("HTTPSConnectionPool(host='rpc', port=443): Max "
+                        "retries exceeded with url: / (range of ports)"))
+    assert not is_range_error(ReadTimeout('read timed out'))
+    assert not is_range_error(Throttled('rpc', 1))
+    assert not is_range_error(
+        ValueError({
+            'code': -32005,
+            'message': 'daily request count exceeded, request rate limited'
+        }))
+
+
+def test_window_grows_only_up_to_rejected_size():
+    window = WindowController('bsc', 'http://rpc', 1024)
+
+    assert window.shrink(ValueError('exceed maximum block range: 1024'))
+    assert window.size == 512
+
+    for _ in range(3):
+        window.update(0, 0.1)
+    assert window.size == 1023
+
+    # Kept with the window.
+    window = WindowController('bsc', 'http://rpc', 1024)
+    assert (window.size, window.ceiling) == (1023, 1024)
+
+
+def test_window_is_per_endpoint_pool():
+    single = PoolProvider('bsc', ['http://a'])
+    pool = PoolProvider('bsc', ['http://a', 'http://b'])
+
+    assert window_endpoint(single) == 'http://a'
+    assert window_endpoint(pool) != window_endpoint(single)